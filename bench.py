@@ -0,0 +1,245 @@
+"""
+Benchmarks for repath.
+
+Run all benchmarks with `python bench.py`, or a selection by name, e.g.
+`python bench.py pattern_generation`.
+
+"""
+import random
+import re
+import subprocess
+import sys
+import urllib
+from timeit import default_timer as timer
+
+import repath
+
+
+def make_routes(count, seed=0):
+    """
+    Generate a reproducible route table resembling a large REST API.
+
+    """
+    rand = random.Random(seed)
+    resources = ['users', 'posts', 'comments', 'tags', 'orgs', 'teams',
+                 'files', 'v1.0', 'search', 'reports']
+    params = [':id%d', ':id%d(\\d+)', ':slug%d', ':name%d?', ':path%d*',
+              ':ext%d(json|xml)']
+    routes = []
+    for index in range(count):
+        parts = ['tenant-%d' % (index % 997)]
+        for depth in range(rand.randint(1, 4)):
+            parts.append(rand.choice(resources))
+            if rand.random() < 0.6:
+                parts.append(rand.choice(params) % depth)
+        routes.append('/' + '/'.join(parts))
+    return routes
+
+
+def best(function, repeat=3):
+    """
+    Return the fastest of several timed calls of the function.
+
+    """
+    times = []
+    for _ in range(repeat):
+        start = timer()
+        function()
+        times.append(timer() - start)
+    return min(times)
+
+
+def report(name, seconds, baseline=None):
+    line = '%-40s %9.3fs' % (name, seconds)
+    if baseline is not None:
+        line += '  (baseline %.3fs, %.1fx)' % (baseline, baseline / seconds)
+    print(line)
+
+
+def legacy_escape_string(string):
+    return re.sub('([.+*?=^!:${}()[\\]|])', r'\\\1', string)
+
+
+def legacy_escape_group(group):
+    return re.sub('([=!:$()])', r'\\\1', group)
+
+
+def bench_pattern_generation(count=100000):
+    tokens = [repath.parse(route) for route in make_routes(count)]
+
+    def generate():
+        for route in tokens:
+            repath.tokens_to_pattern(route)
+
+    current = best(generate)
+    escape_string, escape_group = repath.escape_string, repath.escape_group
+    repath.escape_string, repath.escape_group = (
+        legacy_escape_string, legacy_escape_group)
+    try:
+        baseline = best(generate)
+    finally:
+        repath.escape_string, repath.escape_group = escape_string, escape_group
+
+    report('pattern generation (%d routes)' % count, current, baseline)
+
+
+def bench_import_time(repeat=20):
+    # `python -X importtime` is not available on Python 2, so time whole
+    # interpreter starts and subtract one that imports nothing new.
+    def start(statement):
+        return best(lambda: subprocess.check_call(
+            [sys.executable, '-c', statement]), repeat)
+
+    interpreter = start('import re')
+    report('import repath', start('import re, repath') - interpreter)
+    report('import repath, first parse',
+           start('import re, repath; repath.parse("/:id")') - interpreter)
+
+
+def bench_incremental_reload(count=20000, changed=5):
+    routes = [(route, index) for index, route in enumerate(make_routes(count))]
+    changes = routes[:-changed] + [
+        ('/changed/%d/:id' % index, index) for index in range(changed)]
+
+    router = repath.Router()
+    full = router.reload(routes, background=False).wait().duration
+    partial = router.reload(changes, background=False).wait().duration
+    report('reload %d of %d routes' % (changed, count), partial, full)
+
+
+def bench_bulk_compile(count=20000, processes=0):
+    routes = [(route, index) for index, route in enumerate(make_routes(count))]
+
+    def reload(processes):
+        router = repath.Router()
+        return router.reload(routes, False, processes).wait().duration
+
+    report('compile %d routes in processes' % count,
+           reload(processes), reload(None))
+
+
+def legacy_quote(value, quoting):
+    safe = '' if quoting is repath.VALUE_QUOTING else "-_.!~*'()"
+    if isinstance(value, unicode):
+        value = value.encode('utf8')
+    return urllib.quote(value, safe)
+
+
+def bench_path_building(count=100000):
+    build = repath.compile('/users/:id/posts/:slug/tags/:tag+')
+    rand = random.Random(0)
+    slugs = ['hello-world', u'caf\u00e9 au lait', 'q&a', 'release-notes']
+    params = [{'id': rand.randint(1, 500), 'slug': rand.choice(slugs),
+               'tag': ['news', 'x y']} for _ in range(count)]
+
+    def generate():
+        for values in params:
+            build(values)
+
+    current = best(generate)
+    quote, repath._quote = repath._quote, legacy_quote
+    try:
+        baseline = best(generate)
+    finally:
+        repath._quote = quote
+
+    report('path building (%d paths)' % count, current, baseline)
+
+
+def bench_case_insensitive(count=500, paths=5000):
+    routes = make_routes(count)
+    rand = random.Random(1)
+    requests = []
+    for route in rand.sample(routes, min(paths, count)) * (paths // count):
+        params = {}
+        for token in repath.parse(route):
+            if not isinstance(token, basestring):
+                params[token['name']] = (
+                    'json' if token['pattern'] == 'json|xml' else '12')
+        requests.append(repath.compile(route)(params))
+
+    def matching(options, requests):
+        router = repath.Router(options)
+        router.extend((route, index) for index, route in enumerate(routes))
+        return lambda: [router.match(path) for path in requests]
+
+    mixed = [path.title() for path in requests]
+    sensitive = best(matching({'sensitive': True}, requests))
+    current = best(matching({}, mixed))
+    case_agnostic, repath._case_agnostic = repath._case_agnostic, (
+        lambda tokens: False)
+    try:
+        baseline = best(matching({}, mixed))
+    finally:
+        repath._case_agnostic = case_agnostic
+
+    report('case sensitive matching (%d paths)' % paths, sensitive)
+    report('case insensitive matching (%d paths)' % paths, current, baseline)
+
+
+def bench_mounts(count=300, paths=5000):
+    rand = random.Random(2)
+    mounts = ['/apps/%d/%s' % (index, rand.choice(['admin', 'api', 'www']))
+              for index in range(count)]
+    requests = ['%s/some/deep/path/%d' % (rand.choice(mounts), index)
+                for index in range(paths)]
+
+    def matching():
+        router = repath.Router({'end': False})
+        router.extend((mount, index) for index, mount in enumerate(mounts))
+        return lambda: [router.match(path) for path in requests]
+
+    current = best(matching())
+    mount, repath.Route.mount = repath.Route.mount, property(lambda self: None)
+    try:
+        baseline = best(matching())
+    finally:
+        repath.Route.mount = mount
+
+    report('mount matching (%d mounts)' % count, current, baseline)
+
+
+def bench_tail_capture(count=200000):
+    rand = random.Random(4)
+    routes = [repath.Route('/static/*'), repath.Route('/proxy/:path*')]
+    tail = '/'.join('segment%d' % index for index in range(40))
+    requests = [(rand.choice(routes), rand.choice(['/static/', '/proxy/']) + tail)
+                for _ in range(count)]
+
+    def matching():
+        for route, path in requests:
+            route.match(path)
+
+    current = best(matching)
+    tails = [route.tail for route in routes]
+    for route in routes:
+        route.tail = None
+    try:
+        baseline = best(matching)
+    finally:
+        for route, tail in zip(routes, tails):
+            route.tail = tail
+
+    report('tail capture (%d paths)' % count, current, baseline)
+
+
+BENCHMARKS = [
+    ('pattern_generation', bench_pattern_generation),
+    ('import_time', bench_import_time),
+    ('incremental_reload', bench_incremental_reload),
+    ('bulk_compile', bench_bulk_compile),
+    ('path_building', bench_path_building),
+    ('case_insensitive', bench_case_insensitive),
+    ('mounts', bench_mounts),
+    ('tail_capture', bench_tail_capture),
+]
+
+
+def main(names):
+    for name, benchmark in BENCHMARKS:
+        if not names or name in names:
+            benchmark()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
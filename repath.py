@@ -1,8 +1,47 @@
+import bisect
+import heapq
+import os
 import re
-import urllib
+import sys
+import time
+
+# The most precise wall clock for the platform, as chosen by `timeit`.
+timer = time.clock if sys.platform == 'win32' else time.time
+
+
+class _LazyRegexp(object):
+    """
+    A regular expression that is only compiled when first used.
+
+    Attributes of the compiled expression are cached on the instance, so
+    after the first access they cost the same as on the expression itself.
+
+    """
+    def __init__(self, pattern, flags=0):
+        self._pattern = pattern
+        self._flags = flags
+        self._regexp = None
+
+    def __getattr__(self, name):
+        if self._regexp is None:
+            self._regexp = re.compile(self._pattern, self._flags)
+        value = getattr(self._regexp, name)
+        setattr(self, name, value)
+        return value
+
 
 REGEXP_TYPE = type(re.compile(''))
-PATH_REGEXP = re.compile('|'.join([
+ESCAPE_CACHE_SIZE = 4096
+QUOTE_CACHE_SIZE = 4096
+SPECIAL_CHARACTER = _LazyRegexp('[\\\\:(*]')
+PAREN_CHARACTER = _LazyRegexp('[()]')
+# The preferred path through `(?:\\.|[^()])+`: escape pairs before anything.
+GROUP_RUN = _LazyRegexp('(?:\\\\[^\n]|[^()])*')
+UUID_PATTERN = '-'.join(
+    '[0-9a-fA-F]{%d}' % count for count in (8, 4, 4, 4, 12))
+WORD_CHARACTERS = frozenset(
+    'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_')
+PATH_REGEXP = _LazyRegexp('|'.join([
     # Match escaped characters that would otherwise appear in future matches.
     # This allows the user to escape special characters that won't transform.
     '(\\\\.)',
@@ -16,16 +55,294 @@ PATH_REGEXP = re.compile('|'.join([
 ]))
 
 
+ASCII_LOWER = dict((ord(c), ord(c.lower())) for c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+
+def _fold(string):
+    """
+    Lower case the ASCII letters of a string, like `re.I` compares them.
+
+    """
+    if isinstance(string, unicode):
+        return string.translate(ASCII_LOWER)
+    return string.lower()
+
+
+def _escapes(characters):
+    return (
+        _LazyRegexp('[%s]' % re.escape(characters)),
+        dict((ord(c), u'\\' + c) for c in characters),
+        {},
+    )
+
+
+STRING_ESCAPES = _escapes('.+*?=^!:${}()[]|')
+GROUP_ESCAPES = _escapes('=!:$()')
+
+
+def _escape(string, escapes):
+    """
+    Backslash-escape the characters of an `_escapes` table in the string.
+
+    Unicode strings go through `unicode.translate`; byte strings are only
+    substituted when they contain a special character and are cached, as
+    route tables repeat the same literals and patterns many times.
+
+    """
+    pattern, table, cache = escapes
+    if isinstance(string, unicode):
+        return string.translate(table)
+
+    escaped = cache.get(string)
+    if escaped is None:
+        escaped = string
+        if pattern.search(string):
+            escaped = pattern.sub(r'\\\g<0>', string)
+        if len(cache) >= ESCAPE_CACHE_SIZE:
+            cache.clear()
+        cache[string] = escaped
+    return escaped
+
+
 def escape_string(string):
     """
     Escape URL-acceptable regex special-characters.
 
     """
-    return re.sub('([.+*?=^!:${}()[\\]|])', r'\\\1', string)
+    return _escape(string, STRING_ESCAPES)
+
+
+def _quoting(safe):
+    safe = ''.join(sorted(set(
+        'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_.-' +
+        safe)))
+    return (
+        _LazyRegexp('[^%s]' % re.escape(safe)),
+        tuple(chr(i) if chr(i) in safe else '%%%02X' % i for i in range(256)),
+        {},
+    )
+
+
+VALUE_QUOTING = _quoting('')
+SEGMENT_QUOTING = _quoting("-_.!~*'()")
+UNQUOTE_CACHE = {}
+
+
+def _quote(value, quoting):
+    """
+    Percent-encode the UTF-8 bytes of a value outside a `_quoting` safe set.
+
+    Like `urllib.quote`, but values made of safe ASCII characters are returned
+    without further work, and others are encoded through a precomputed table
+    and cached (up to `QUOTE_CACHE_SIZE` values), as the same IDs and slugs
+    are built into paths over and over.
+
+    """
+    unsafe, table, cache = quoting
+    if unsafe.search(value) is None:
+        return str(value)
+
+    quoted = cache.get(value)
+    if quoted is None:
+        data = value.encode('utf8') if isinstance(value, unicode) else value
+        quoted = ''.join([table[byte] for byte in bytearray(data)])
+        if QUOTE_CACHE_SIZE:
+            if len(cache) >= QUOTE_CACHE_SIZE:
+                cache.clear()
+            cache[value] = quoted
+    return quoted
+
+
+def _unquote(value):
+    """
+    Percent-decode a value, as encoded by `_quote`.
+
+    Decoded values are UTF-8 decoded to unicode when they are not ASCII (and
+    left as bytes when not valid UTF-8). Values are cached, up to
+    `QUOTE_CACHE_SIZE` of them.
+
+    """
+    unquoted = UNQUOTE_CACHE.get(value)
+    if unquoted is None:
+        from urllib import unquote
+
+        data = value.encode('utf8') if isinstance(value, unicode) else value
+        unquoted = unquote(data)
+        try:
+            unquoted.decode('ascii')
+        except UnicodeDecodeError:
+            try:
+                unquoted = unquoted.decode('utf8')
+            except UnicodeDecodeError:
+                pass
+        if QUOTE_CACHE_SIZE:
+            if len(UNQUOTE_CACHE) >= QUOTE_CACHE_SIZE:
+                UNQUOTE_CACHE.clear()
+            UNQUOTE_CACHE[value] = unquoted
+    return unquoted
+
+
+def _decode_params(params):
+    for name, value in params.items():
+        if value is not None and '%' in value:
+            params[name] = _unquote(value)
 
 
 def escape_group(group):
-    return re.sub('([=!:$()])', r'\\\1', group)
+    return _escape(group, GROUP_ESCAPES)
+
+
+class Converter(object):
+    """
+    A parameter type: the pattern it matches and how to convert values.
+
+    `decode` turns a matched string into a value, raising `ValueError` to
+    reject it, and `encode` turns a value back into a string for paths.
+
+    """
+    def __init__(self, pattern, decode, encode=unicode):
+        self.pattern = pattern
+        self.decode = decode
+        self.encode = encode
+
+    def __repr__(self):
+        return '<Converter %r>' % (self.pattern,)
+
+
+def _uuid(value):
+    import uuid
+    return uuid.UUID(value)
+
+
+def _float_text(value):
+    """
+    Format a float like `repr` but without an exponent, as the pattern
+    of the `float` converter requires.
+
+    """
+    text = repr(float(value))
+    if 'e' not in text:
+        return text
+    mantissa, exponent = text.split('e')
+    places = len(mantissa.partition('.')[2]) - int(exponent)
+    return '%.*f' % (max(places, 0), float(value))
+
+
+CONVERTERS = {
+    'int': Converter('\\d+', int),
+    'float': Converter('\\d+(?:\\.\\d+)?', float, _float_text),
+    'uuid': Converter(UUID_PATTERN, _uuid),
+}
+
+
+def register_converter(name, pattern, decode, encode=unicode):
+    """
+    Register a converter, used in paths as `:name<converter>`.
+
+    The pattern must not contain capturing groups. Matched values of repeated
+    parameters are not decoded, but each value is encoded when building.
+
+    """
+    CONVERTERS[name] = Converter(pattern, decode, encode)
+
+
+def _scan_group(string, start):
+    """
+    Return the index of the `)` closing a group whose content starts at start.
+
+    Mirrors `((?:\\\\.|[^()])+)\\)` from `PATH_REGEXP`, including the order
+    it backtracks in when escapes are ambiguous. Return `None` when the group
+    is not closed.
+
+    """
+    length = len(string)
+
+    # Follow the preferred (escaping) choices first, as the regexp would.
+    position = GROUP_RUN.match(string, start).end()
+    if position < length and string[position] == ')' and position > start:
+        return position
+
+    limit = start
+    while True:
+        paren = PAREN_CHARACTER.search(string, limit)
+        if paren is None:
+            limit = length
+            break
+        limit = paren.start()
+        if limit == start or string[limit - 1] != '\\':
+            break
+        limit += 1
+
+    closed = limit < length and string[limit] == ')' and limit > start
+    if string.find('\\', start, limit) == -1:
+        return limit if closed else None
+
+    # Backslashes may escape or be matched literally; resolve from the end.
+    ends = [None] * (limit - start + 1)
+    ends[-1] = limit if closed else None
+    for index in range(limit - 1, start - 1, -1):
+        char = string[index]
+        end = None
+        if char == '\\' and index + 1 < length and string[index + 1] != '\n':
+            end = ends[index + 2 - start]
+        if end is None and char not in '()':
+            end = ends[index + 1 - start]
+        if end is None and char == ')' and index > start:
+            end = index
+        ends[index - start] = end
+
+    return ends[0]
+
+
+def _scan_param(string, index):
+    """
+    Scan a parameter (without prefix) starting at index.
+
+    Return `(name, pattern, suffix, asterisk, end, converter)` or `None`.
+
+    """
+    length = len(string)
+    char = string[index]
+
+    if char == '*':
+        return None, None, None, True, index + 1, None
+
+    if char == ':':
+        end = index + 1
+        while end < length and string[end] in WORD_CHARACTERS:
+            end += 1
+        if end == index + 1:
+            return None
+        name = string[index + 1:end]
+        pattern = None
+        converter = None
+        if end < length and string[end] == '<':
+            close = string.find('>', end + 1)
+            if close != -1 and string[end + 1:close] in CONVERTERS:
+                converter = string[end + 1:close]
+                end = close + 1
+        if converter is None and end < length and string[end] == '(':
+            close = _scan_group(string, end + 1)
+            if close is not None:
+                pattern = string[end + 1:close]
+                end = close + 1
+    elif char == '(':
+        close = _scan_group(string, index + 1)
+        if close is None:
+            return None
+        name = None
+        converter = None
+        pattern = string[index + 1:close]
+        end = close + 1
+    else:
+        return None
+
+    suffix = None
+    if end < length and string[end] in '+*?':
+        suffix = string[end]
+        end += 1
+
+    return name, pattern, suffix, False, end, converter
 
 
 def parse(string):
@@ -37,29 +354,51 @@ def parse(string):
     """
     tokens = []
     key = 0
+    path = []
+    length = len(string)
     index = 0
-    path = ''
-
-    for match in PATH_REGEXP.finditer(string):
-        matched = match.group(0)
-        escaped = match.group(1)
-        offset = match.start(0)
-        path += string[index:offset]
-        index = offset + len(matched)
+    position = 0
+
+    while position < length:
+        special = SPECIAL_CHARACTER.search(string, position)
+        if special is None:
+            break
+        position = special.start()
+
+        if string[position] == '\\':
+            if position + 1 < length and string[position + 1] != '\n':
+                path.append(string[index:position])
+                path.append(string[position + 1])
+                position += 2
+                index = position
+            else:
+                position += 1
+            continue
 
-        if escaped:
-            path += escaped[1]
+        param = _scan_param(string, position)
+        if param is None:
+            position += 1
             continue
 
+        prefix = None
+        if position > index and string[position - 1] in '/.':
+            position -= 1
+            prefix = string[position]
+
+        path.append(string[index:position])
+        path = ''.join(path)
         if path:
             tokens.append(path)
-            path = ''
+        path = []
 
-        prefix, name, capture, group, suffix, asterisk = match.groups()[1:]
+        name, pattern, suffix, asterisk, index, converter = param
+        position = index
         repeat = suffix in ('+', '*')
         optional = suffix in ('?', '*')
         delimiter = prefix or '/'
-        pattern = capture or group or ('.*' if asterisk else '[^%s]+?' % delimiter)
+        pattern = pattern or ('.*' if asterisk else '[^%s]+?' % delimiter)
+        if converter is not None:
+            pattern = CONVERTERS[converter].pattern
 
         if not name:
             name = key
@@ -73,12 +412,14 @@ def parse(string):
             'repeat': repeat,
             'pattern': escape_group(pattern),
         }
+        if converter is not None:
+            token['pattern'] = pattern
+            token['converter'] = converter
 
         tokens.append(token)
 
-    if index < len(string):
-        path += string[index:]
-
+    path.append(string[index:])
+    path = ''.join(path)
     if path:
         tokens.append(path)
 
@@ -90,6 +431,11 @@ def tokens_to_function(tokens):
     Expose a method for transforming tokens into the path function.
 
     """
+    regexps = {}
+    for key in tokens:
+        if not isinstance(key, basestring):
+            regexps[key['pattern']] = re.compile('^%s$' % key['pattern'])
+
     def transform(obj):
         path = ''
         obj = obj or {}
@@ -99,7 +445,10 @@ def tokens_to_function(tokens):
                 path += key
                 continue
 
-            regexp = re.compile('^%s$' % key['pattern'])
+            regexp = regexps[key['pattern']]
+            encode = unicode
+            if 'converter' in key:
+                encode = CONVERTERS[key['converter']].encode
 
             value = obj.get(key['name'])
             if value is None:
@@ -125,24 +474,24 @@ def tokens_to_function(tokens):
                         )
 
                 for i, val in enumerate(value):
-                    val = unicode(val)
+                    val = encode(val)
                     if not regexp.search(val):
                         raise ValueError(
                             'Expected all "{name}" to match "{pattern}"'.format(**key)
                         )
 
                     path += key['prefix'] if i == 0 else key['delimiter']
-                    path += urllib.quote(val, '')
+                    path += _quote(val, VALUE_QUOTING)
 
                 continue
 
-            value = unicode(value)
+            value = encode(value)
             if not regexp.search(value):
                 raise ValueError(
                     'Expected "{name}" to match "{pattern}"'.format(**key)
                 )
 
-            path += key['prefix'] + urllib.quote(value.encode('utf8'), '-_.!~*\'()')
+            path += key['prefix'] + _quote(value, SEGMENT_QUOTING)
 
         return path
 
@@ -207,7 +556,7 @@ def tokens_to_pattern(tokens, options=None):
         }
 
         if token['name'] and re.search('[a-zA-Z]', token['name']):
-            parts['name'] = '?P<%s>' % re.escape(token['name'])
+            parts['name'] = '?P<%s>' % token['name']
 
         if token['repeat']:
             parts['capture'] += PATTERNS['REPEAT'].format(**parts)
@@ -280,3 +629,2260 @@ def compile(string):
 
     """
     return tokens_to_function(parse(string))
+
+
+def _first_segment(tokens):
+    """
+    Return the literal first path segment of the tokens, if there is one.
+
+    `None` is returned when the first segment contains (or may contain) a
+    parameter.
+
+    """
+    if not tokens or not isinstance(tokens[0], basestring):
+        return None
+    if not tokens[0].startswith('/'):
+        return None
+
+    segment, slash, _ = tokens[0][1:].partition('/')
+    if slash:
+        return segment
+    if segment and (len(tokens) == 1 or tokens[1]['prefix'] == '/'):
+        return segment
+    return None
+
+
+def _segment_bounds(tokens, options=None):
+    """
+    Return the minimum and maximum number of `/` in a path matching tokens.
+
+    The maximum is `None` when it is unbounded.
+
+    """
+    options = options or {}
+    low = high = 0
+
+    for token in tokens:
+        if isinstance(token, basestring):
+            low += token.count('/')
+            if high is not None:
+                high += token.count('/')
+            continue
+
+        slashes = token['prefix'].count('/')
+        if not token['optional']:
+            low += slashes
+        if token['repeat'] or token['pattern'] != '[^/]+?':
+            high = None
+        elif high is not None:
+            high += slashes
+
+    if not options.get('strict'):
+        last = tokens[-1] if tokens else ''
+        if isinstance(last, basestring) and last.endswith('/'):
+            low -= 1
+        elif high is not None:
+            high += 1
+
+    if options.get('end') == False:
+        high = None
+
+    return low, high
+
+
+def batch_match(paths, routes, options=None, flags=0):
+    """
+    Match a batch of paths against a list of express-style routes.
+
+    Cheap features (the number of `/` and the first path segment) are computed
+    for the whole batch with NumPy and compared against bounds derived from
+    each route's tokens, so the generated regular expression only runs on
+    candidate path/route pairs.
+
+    Return an integer array holding, for each path, the index of the first
+    route it matches or `-1`. NumPy is required.
+
+    """
+    import numpy
+
+    paths = numpy.asarray(paths)
+    result = numpy.full(len(paths), -1, dtype=numpy.intp)
+    if not len(paths):
+        return result
+
+    keys = paths if not flags & re.I else numpy.char.lower(paths)
+    counts = numpy.char.count(keys, '/')
+    head, _, tail = numpy.char.partition(keys, '/').T
+    firsts, codes = numpy.unique(
+        numpy.char.partition(tail, '/')[:, 0], return_inverse=True)
+    codes[head != ''] = -1
+
+    for index, route in enumerate(routes):
+        tokens = parse(route)
+        regexp = re.compile(tokens_to_pattern(tokens, options), flags)
+        low, high = _segment_bounds(tokens, options)
+
+        mask = (result == -1) & (counts >= low)
+        if high is not None:
+            mask &= counts <= high
+
+        first = _first_segment(tokens)
+        if first is not None:
+            if flags & re.I:
+                first = first.lower()
+            code = numpy.searchsorted(firsts, first)
+            if code == len(firsts) or firsts[code] != first:
+                continue
+            mask &= codes == code
+
+        for candidate in numpy.flatnonzero(mask):
+            if regexp.match(paths[candidate]):
+                result[candidate] = index
+
+    return result
+
+
+def specificity(tokens, options=None):
+    """
+    Return a sortable specificity score for a list of tokens.
+
+    Higher scores are more specific. Routes are ranked by the number of fully
+    static segments, then full (`end`) matching, then by the fewest asterisk,
+    repeat and optional parameters, and finally by the number of parameters
+    with a custom pattern.
+
+    """
+    options = options or {}
+    shape = ''.join(
+        token if isinstance(token, basestring) else token['prefix'] + '\0'
+        for token in tokens
+    )
+    params = [token for token in tokens if not isinstance(token, basestring)]
+    asterisks = [token for token in params if token['pattern'] == '.*']
+    custom = [
+        token for token in params
+        if token['pattern'] not in ('.*', '[^%s]+?' % token['delimiter'])
+    ]
+
+    return (
+        len([s for s in shape.split('/') if s and '\0' not in s]),
+        options.get('end') != False,
+        -len(asterisks),
+        -len([token for token in params if token['repeat']]),
+        -len([token for token in params if token['optional']]),
+        len(custom),
+    )
+
+
+def _route_key(path, options):
+    """
+    Return a hashable key identifying a path and its options.
+
+    """
+    if isinstance(path, list):
+        path = tuple(path)
+    return path, tuple(sorted(
+        (name, tuple(value) if isinstance(value, list) else value)
+        for name, value in options.items()
+    ))
+
+
+# `sre_compile._code` and the arguments of `_sre.compile` are private and
+# only known to have this shape on CPython 2.7.
+SRE_ARGUMENTS = (sys.version_info[:2] == (2, 7) and
+                 getattr(sys, 'subversion', ('CPython',))[0] == 'CPython')
+
+
+def _sre_arguments(pattern, flags):
+    """
+    Return the arguments `sre_compile` passes to `_sre.compile` for a pattern.
+
+    Compiled expressions are pickled as their source and compiled again, so
+    this is how the work of compiling is carried across processes. Return
+    `None` on other interpreters (see `SRE_ARGUMENTS`) or when the internals
+    differ from the expected ones.
+
+    """
+    if not SRE_ARGUMENTS:
+        return None
+    try:
+        import sre_compile
+        import sre_parse
+        parsed = sre_parse.parse(pattern, flags)
+        code = sre_compile._code(parsed, flags)
+        if parsed.pattern.groups > 100:
+            # Leave `re.compile` to raise its error for too many groups.
+            return None
+        groupindex = parsed.pattern.groupdict
+        indexgroup = [None] * parsed.pattern.groups
+        for name, index in groupindex.items():
+            indexgroup[index] = name
+        return (
+            pattern, flags | parsed.pattern.flags, code,
+            parsed.pattern.groups - 1, groupindex, indexgroup,
+        )
+    except Exception:
+        return None
+
+
+def _sre_compile(pattern, flags, arguments=None):
+    """
+    Compile a pattern, from `_sre_arguments` when they are given.
+
+    """
+    if arguments is not None and SRE_ARGUMENTS:
+        try:
+            import _sre
+            return _sre.compile(*arguments)
+        except Exception:
+            pass
+    return re.compile(pattern, flags)
+
+
+def _case_agnostic(tokens):
+    """
+    Return whether no parameter pattern of the tokens depends on letter case.
+
+    Patterns are case agnostic when they contain no letters outside of escapes
+    such as `\\d` or `\\.`.
+
+    """
+    for token in tokens:
+        if not isinstance(token, basestring):
+            pattern = token['pattern']
+            # Numeric, hex and unicode escapes and backreferences can stand
+            # for letters.
+            escaped = re.findall(r'\\(.)', pattern)
+            if any(c in '0123456789xuUN' for c in escaped):
+                return False
+            if re.search('[a-zA-Z]', re.sub(r'\\.', '', pattern)):
+                return False
+    return True
+
+
+def _compile_route(path, options, portable=False):
+    """
+    Compile everything about a route that does not depend on its value.
+
+    Return `(tokens, pattern, keys, score, folded, arguments)`, where `folded`
+    is the case sensitive pattern to match lower cased paths with in place of
+    a case insensitive `pattern`, if the route allows it, and `arguments` are
+    the `_sre_arguments` when `portable`, for the regexp to be built in
+    another process.
+
+    """
+    keys = []
+    folded = None
+    if isinstance(path, basestring):
+        tokens = parse(path)
+        pattern = tokens_to_pattern(tokens, options)
+        keys.extend(t for t in tokens if not isinstance(t, basestring))
+        score = specificity(tokens, options)
+        if not options.get('sensitive') and _case_agnostic(tokens):
+            folded = tokens_to_pattern([
+                _fold(token) if isinstance(token, basestring) else token
+                for token in tokens
+            ], options)
+    else:
+        tokens = None
+        pattern = path_to_pattern(path, keys, options)
+        score = ()
+
+    arguments = None
+    if portable:
+        flags = 0 if options.get('sensitive') or folded else re.I
+        arguments = _sre_arguments(folded or pattern, flags)
+    return tokens, pattern, keys, score, folded, arguments
+
+
+def _compile_routes(specs):
+    return [_compile_route(path, options, True) for path, options in specs]
+
+
+def bulk_compile(specs, processes=None):
+    """
+    Compile `(path, options)` tuples in a pool of worker processes.
+
+    Workers parse the paths, generate the patterns and the specificity used
+    for indexing, and compile the regular expressions; return the results,
+    ready to be passed as `Route(..., compiled=...)`.
+
+    """
+    import multiprocessing
+
+    specs = list(specs)
+    processes = processes or multiprocessing.cpu_count()
+    size = max(1, -(-len(specs) // (processes * 4)))
+    chunks = [specs[i:i + size] for i in range(0, len(specs), size)]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_compile_routes, chunks)
+    finally:
+        pool.close()
+        pool.join()
+    return [compiled for chunk in results for compiled in chunk]
+
+
+def load_sources(sources, threads=None):
+    """
+    Read routes from many sources in a pool of threads.
+
+    `sources` is a list of `(name, read)` tuples, or a dictionary of them
+    taken in name order, where `read()` returns `(path, value[, options])`
+    tuples. Return the routes of all sources, in source order, and a
+    dictionary of the time in seconds each source took to read.
+
+    """
+    from multiprocessing.pool import ThreadPool
+
+    if isinstance(sources, dict):
+        sources = sorted(sources.items())
+    sources = list(sources)
+
+    def run(source):
+        start = timer()
+        routes = list(source[1]())
+        return routes, timer() - start
+
+    pool = ThreadPool(threads or min(len(sources), 16) or 1)
+    try:
+        results = pool.map(run, sources)
+    finally:
+        pool.close()
+        pool.join()
+
+    routes = [route for result, _ in results for route in result]
+    timings = dict((name, elapsed)
+                   for (name, _), (_, elapsed) in zip(sources, results))
+    return routes, timings
+
+
+OPENAPI_METHODS = ('get', 'put', 'post', 'delete', 'options', 'head',
+                   'patch', 'trace')
+OPENAPI_TEMPLATE = _LazyRegexp('{([^{}]+)}')
+JSON_STRING_RUN = _LazyRegexp('[^"\\\\]*')
+JSON_STRUCTURE_RUN = _LazyRegexp('[^"\\[\\]{}]*')
+
+
+class _JSONStream(object):
+    """
+    Incremental reader for the structure of a JSON document.
+
+    Objects are walked key by key while values are decoded one at a time, so
+    only the value being read is held in memory. Values that are not needed
+    can be skipped without decoding them.
+
+    """
+    def __init__(self, handle, size=65536):
+        import json
+
+        self.handle = handle
+        self.size = size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+
+    def _fill(self, size):
+        data = self.handle.read(size)
+        self.buffer = self.buffer[self.position:] + data
+        self.position = 0
+        self.eof = not data
+
+    def peek(self):
+        while True:
+            buffer, position = self.buffer, self.position
+            while position < len(buffer) and buffer[position] in ' \t\r\n':
+                position += 1
+            self.position = position
+            if position < len(buffer):
+                return buffer[position]
+            if self.eof:
+                raise ValueError('Unexpected end of JSON document')
+            self._fill(self.size)
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise ValueError('Expected %r at JSON offset %d' % (
+                character, self.position))
+        self.position += 1
+
+    def value(self):
+        self.peek()
+        size = self.size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except ValueError:
+                end = None
+            # A number ending with the buffer, or before a character that
+            # cannot follow a value, such as the `e` of `1.5e3`, may be cut.
+            if end is not None and (self.eof or (
+                    end < len(self.buffer) and
+                    self.buffer[end] in ' \t\r\n,:]}')):
+                self.position = end
+                return value
+            if self.eof:
+                raise ValueError('Invalid JSON at offset %d' % self.position)
+            self._fill(size)
+            size *= 2
+
+    def skip(self):
+        """
+        Read past the next value, scanning strings and brackets only.
+
+        """
+        if self.peek() not in '"[{':
+            self.value()
+            return
+
+        depth = 0
+        string = False
+        while True:
+            buffer, position = self.buffer, self.position
+            while position < len(buffer):
+                if string:
+                    position = JSON_STRING_RUN.match(buffer, position).end()
+                    if position == len(buffer):
+                        break
+                    if buffer[position] == '\\':
+                        if position + 1 == len(buffer):
+                            break
+                        position += 2
+                        continue
+                    string = False
+                    position += 1
+                    if not depth:
+                        self.position = position
+                        return
+                    continue
+                position = JSON_STRUCTURE_RUN.match(buffer, position).end()
+                if position == len(buffer):
+                    break
+                character = buffer[position]
+                position += 1
+                if character == '"':
+                    string = True
+                elif character in '[{':
+                    depth += 1
+                else:
+                    depth -= 1
+                    if not depth:
+                        self.position = position
+                        return
+            self.position = position
+            if self.eof:
+                raise ValueError('Unexpected end of JSON document')
+            self._fill(self.size)
+
+    def items(self):
+        """
+        Yield the keys of an object; read each value before the next key.
+
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.position += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == '}':
+                self.position += 1
+                return
+            self.expect(',')
+
+
+def _openapi_pattern(schema):
+    values = [unicode(value) for value in schema.get('enum') or ()]
+    if values and not any('(' in value or ')' in value for value in values):
+        # `parse()` escapes the group characters of the pattern itself.
+        return '|'.join(re.sub('([.+*?^{}[\\]|\\\\])', r'\\\1', value)
+                        for value in values)
+    if schema.get('type') == 'integer':
+        return '-?\\d+'
+    if schema.get('format') == 'uuid':
+        return UUID_PATTERN
+    return None
+
+
+def _openapi_literal(text):
+    return re.sub('([\\\\:(*+?])', r'\\\1', text)
+
+
+def openapi_path(template, parameters=()):
+    """
+    Convert an OpenAPI path template to a path for `parse()`.
+
+    `{name}` placeholders become parameters, restricted to integers, UUIDs
+    or enumerated values when the path parameter's schema says so. Non-word
+    characters of parameter names are replaced with underscores.
+
+    """
+    patterns = {}
+    for parameter in parameters:
+        if parameter.get('in') == 'path' and 'name' in parameter:
+            patterns[parameter['name']] = _openapi_pattern(
+                parameter.get('schema', parameter))
+
+    path = []
+    index = 0
+    for match in OPENAPI_TEMPLATE.finditer(template):
+        name = match.group(1)
+        path.append(_openapi_literal(template[index:match.start()]))
+        path.append(':' + re.sub('\\W', '_', name))
+        pattern = patterns.get(name)
+        if not pattern and template[match.end():match.end() + 1] in WORD_CHARACTERS:
+            # Without a group, `parse()` would read on into the name.
+            delimiter = template[match.start() - 1:match.start()]
+            pattern = '[^%s]+?' % (delimiter if delimiter in ('/', '.') else '/')
+        if pattern:
+            path.append('(%s)' % pattern)
+        index = match.end()
+    path.append(_openapi_literal(template[index:]))
+    return ''.join(path)
+
+
+def openapi_routes(filename, prefix=''):
+    """
+    Stream routes from an OpenAPI 3 or Swagger 2 JSON document.
+
+    Yield a `(path, value, options)` tuple for every operation, restricted to
+    its method, with the `operationId` (or `'METHOD template'`) as the value.
+    The document is read incrementally, one path item at a time. Parameters
+    given as `$ref` are not resolved and match any segment.
+
+    """
+    with open(filename, 'rb') as handle:
+        stream = _JSONStream(handle)
+        for key in stream.items():
+            if key != 'paths':
+                stream.skip()
+                continue
+
+            for template in stream.items():
+                item = stream.value()
+                shared = item.get('parameters', [])
+                for method in OPENAPI_METHODS:
+                    operation = item.get(method)
+                    if operation is None:
+                        continue
+                    names = set(parameter.get('name')
+                                for parameter in operation.get('parameters', []))
+                    parameters = [parameter for parameter in shared
+                                  if parameter.get('name') not in names]
+                    parameters += operation.get('parameters', [])
+
+                    value = operation.get('operationId') or '%s %s' % (
+                        method.upper(), template)
+                    yield (prefix + openapi_path(template, parameters), value,
+                           {'methods': [method.upper()]})
+
+
+class Route(object):
+    """
+    A path compiled for matching by a `Router`.
+
+    """
+    def __init__(self, path, value=None, options=None, index=0,
+                 compiled=None):
+        self.path = path
+        self.value = value
+        self.options = options or {}
+        self.index = index
+        methods = self.options.get('methods')
+        self.methods = frozenset(m.upper() for m in methods) if methods else None
+
+        if compiled is None:
+            compiled = _compile_route(path, self.options)
+        (self.tokens, self.pattern, self.keys, self.score, folded,
+         arguments) = compiled
+
+        self.folded = folded is not None
+        self.tail = _tail(self.tokens, self.options)
+        if self.tail is not None and self.folded:
+            self.tail = (_fold(self.tail[0]),) + self.tail[1:]
+        self.flags = 0 if self.options.get('sensitive') or folded else re.I
+        self.decode = bool(self.options.get('decode'))
+        self.regexp = _sre_compile(folded or self.pattern, self.flags, arguments)
+        self.rank = (self.score, -index)
+        self.names = [str(key['name']) for key in self.keys]
+        self.decoders = tuple(
+            (str(key['name']), CONVERTERS[key['converter']].decode)
+            for key in self.keys if 'converter' in key and not key['repeat'])
+        self.key = _route_key(path, self.options)
+        # Cached for the overlap analysis of `_disjoint`.
+        first = _first_segment(self.tokens)
+        self.segment = first.lower() if first is not None else None
+        self.prefix = _literal_prefix(self.tokens, self.options)
+        self.bounds = (None if self.tokens is None else
+                       _segment_bounds(self.tokens, self.options))
+        self._function = None
+
+    def __repr__(self):
+        return '<Route %r>' % (self.path,)
+
+    def with_value(self, value, index=None):
+        """
+        Return a copy of the route with a different value (and index).
+
+        The copy shares the tokens, pattern and compiled regexp, but not the
+        instrumentation a `Router` wrapped around the route's methods.
+
+        """
+        import copy
+
+        route = copy.copy(self)
+        route.__dict__.pop('match', None)
+        route.__dict__.pop('build', None)
+        route.value = value
+        if index is not None:
+            route.index = index
+            route.rank = (route.score, -index)
+        return route
+
+    @property
+    def static(self):
+        """
+        The literal path this route matches exactly, or `None`.
+
+        """
+        if self.tokens is None or self.options.get('end') == False:
+            return None
+        if not self.tokens:
+            return ''
+        if len(self.tokens) > 1 or not isinstance(self.tokens[0], basestring):
+            return None
+        if self.tokens[0].endswith('//') and not self.options.get('strict'):
+            # `/a//` also matches `/a/`, which `_static_key` would look up
+            # as `/a`, so such routes are matched by their regexp.
+            return None
+        return self.tokens[0]
+
+    @property
+    def mount(self):
+        """
+        The literal prefix this `end=False` route matches paths under, or
+        `None`.
+
+        """
+        if self.tokens is None or self.options.get('end') != False:
+            return None
+        if len(self.tokens) != 1 or not isinstance(self.tokens[0], basestring):
+            return None
+        if self.options.get('strict') and self.tokens[0].endswith('/'):
+            return None
+        return self.tokens[0]
+
+    def match(self, path, lower=None):
+        """
+        Match the path, returning a dictionary of parameters or `None`.
+
+        Case insensitive routes without case dependent parameter patterns
+        match `lower`, the path folded by `_fold`, with a case sensitive regexp
+        and take their parameters from the original path. Pass it when trying
+        many routes to fold the path only once. Routes ending in a catch-all
+        parameter (see `_tail`) check their literal prefix and slice the rest
+        of the path without running the regexp.
+
+        """
+        if self.tail is not None and '\n' not in path:
+            params = self._match_tail(path, lower)
+            if params is None:
+                return None
+        elif self.folded:
+            match = self.regexp.match(_fold(path) if lower is None else lower)
+            if match is None:
+                return None
+            params = {}
+            for name, (start, end) in zip(self.names, match.regs[1:]):
+                params[name] = path[start:end] if start != -1 else None
+        else:
+            match = self.regexp.match(path)
+            if match is None:
+                return None
+            params = dict(zip(self.names, match.groups()))
+        if self.decode:
+            _decode_params(params)
+        for name, decode in self.decoders:
+            if params[name] is not None:
+                try:
+                    params[name] = decode(params[name])
+                except ValueError:
+                    return None
+        return params
+
+    def _match_tail(self, path, lower):
+        literal, rest, optional, strict = self.tail
+        if self.folded:
+            subject = _fold(path) if lower is None else lower
+        else:
+            subject = path
+        if not subject.startswith(literal):
+            return None
+
+        tail = path[len(literal):]
+        if rest:
+            return {self.names[0]: tail}
+
+        if not strict and tail.endswith('/'):
+            tail = tail[:-1]
+        if not tail:
+            return {self.names[0]: None} if optional else None
+        if tail[0] != '/' or len(tail) == 1 or tail.endswith('/') or '//' in tail:
+            return None
+        return {self.names[0]: tail[1:]}
+
+    def build(self, params=None):
+        """
+        Build a path for the route from a dictionary of parameters.
+
+        Equivalent to `compile(path)(params)`.
+
+        """
+        if self._function is None:
+            if self.tokens is None:
+                raise TypeError('Expected a string path to build %r' % self.path)
+            self._function = tokens_to_function(self.tokens)
+        return self._function(params)
+
+
+def normalize_path(path):
+    """
+    Normalize a request path in a single scan.
+
+    The query string and fragment are dropped, empty segments collapsed and
+    `.` and `..` segments resolved as in RFC 3986, keeping a trailing slash.
+    Return the normalized path and the list of its segments, which is built
+    during the scan anyway and saves splitting the path again.
+
+    """
+    end = len(path)
+    for mark in '?#':
+        index = path.find(mark, 0, end)
+        if index != -1:
+            end = index
+
+    segments = []
+    segment = None
+    start = 1 if path[:1] == '/' else 0
+    clean = start == 1
+    while start <= end:
+        stop = path.find('/', start, end)
+        if stop == -1:
+            stop = end
+        segment = path[start:stop]
+        if segment == '..':
+            if segments:
+                segments.pop()
+            clean = False
+        elif segment == '.':
+            clean = False
+        elif segment:
+            segments.append(segment)
+        elif stop != end:
+            clean = False
+        start = stop + 1
+
+    if clean:
+        return path[:end], segments
+
+    path = '/' + '/'.join(segments)
+    if segments and segment in ('', '.', '..'):
+        path += '/'
+    return path, segments
+
+
+def _normalized(path):
+    """
+    Return `normalize_path(path)[0]` without building the list of segments
+    when the path needs no changes besides dropping a query or fragment.
+
+    """
+    for mark in '?#':
+        index = path.find(mark)
+        if index != -1:
+            path = path[:index]
+    if path[:1] == '/' and '//' not in path and '/.' not in path:
+        return path
+    return normalize_path(path)[0]
+
+
+def _static_key(path, strict, sensitive):
+    if not strict and path.endswith('/'):
+        path = path[:-1]
+    return path if sensitive else _fold(path)
+
+
+def _tail(tokens, options):
+    """
+    Describe a route ending in a catch-all parameter matchable without regexp.
+
+    Return `(literal, rest, optional, strict)` for routes made of a literal
+    followed by an asterisk (or other `.*` parameter), when `rest`, or by a
+    repeated segment parameter such as `:path*` or `:path+`; otherwise `None`.
+
+    """
+    if not tokens or isinstance(tokens[-1], basestring) or len(tokens) > 2:
+        return None
+    if len(tokens) == 2 and not isinstance(tokens[0], basestring):
+        return None
+    literal = tokens[0] if len(tokens) == 2 else ''
+    token = tokens[-1]
+    if 'converter' in token:
+        return None
+    if token['pattern'] == '.*' and not token['repeat'] and not token['optional']:
+        return literal + token['prefix'], True, False, False
+    if (token['repeat'] and token['pattern'] == '[^/]+?' and
+            token['prefix'] == '/' and options.get('end') != False):
+        return literal, False, token['optional'], bool(options.get('strict'))
+    return None
+
+
+def _mount_lookup(table, path):
+    """
+    Find the route mounted at the longest prefix of the path ending at a `/`.
+
+    """
+    end = len(path)
+    while end != -1:
+        route = table.get(path[:end])
+        if route is not None:
+            return route
+        end = path.rfind('/', 0, end) if end else -1
+    return None
+
+
+def _literal_prefix(tokens, options):
+    """
+    Return the literal text every path matched by the tokens starts with.
+
+    """
+    if not tokens or not isinstance(tokens[0], basestring):
+        return ''
+    prefix = tokens[0]
+    if len(tokens) == 1 and not options.get('strict'):
+        prefix = prefix[:-1] if prefix.endswith('/') else prefix
+    return prefix.lower()
+
+
+def _disjoint(a, b):
+    """
+    Return whether static analysis proves no path can match both routes.
+
+    """
+    if a.tokens is None or b.tokens is None:
+        return False
+    if a.segment is not None and b.segment is not None and a.segment != b.segment:
+        return True
+    if not (a.prefix.startswith(b.prefix) or b.prefix.startswith(a.prefix)):
+        return True
+
+    (a_low, a_high), (b_low, b_high) = a.bounds, b.bounds
+    return (
+        (a_high is not None and a_high < b_low) or
+        (b_high is not None and b_high < a_low)
+    )
+
+
+class RouteTable(object):
+    """
+    An immutable snapshot of routes, indexed for matching.
+
+    Fully static routes are found with a dictionary lookup; dynamic routes are
+    scanned in `order`, which defaults to their rank. Tables are never changed
+    after they are built, so any number of threads can match against one
+    without locking.
+
+    When built from a `previous` table, static index buckets whose routes are
+    unchanged are shared with it and the overlap analysis used for reordering
+    is only computed for new routes.
+
+    Routes restricted to HTTP `methods` are also partitioned into a table per
+    method (holding the routes for that method and for any method), so
+    matching a request only searches its method's partition.
+
+    Literal `end=False` routes are `mounted` in a prefix index instead of being
+    scanned: the longest mount point a path is under is found with one lookup
+    per path segment.
+
+    """
+    def __init__(self, routes=(), order=None, previous=None, partition=True,
+                 origins=None):
+        self.routes = tuple(routes)
+        self.origins = origins or {}
+        self.methods = None
+        if partition and any(route.methods for route in self.routes):
+            self._partition(previous)
+
+        members = {}
+        dynamic = []
+        mounted = []
+
+        for route in self.routes:
+            if route.static is None:
+                if route.mount is None:
+                    dynamic.append(route)
+                else:
+                    mounted.append(route)
+                continue
+            bucket = (
+                bool(route.options.get('strict')),
+                bool(route.options.get('sensitive')),
+            )
+            members.setdefault(bucket, []).append(route)
+
+        old = dict(previous._buckets) if previous is not None else {}
+        self._buckets = []
+        for bucket, routes in members.items():
+            routes = frozenset(routes)
+            if bucket in old and old[bucket][0] == routes:
+                self._buckets.append((bucket, old[bucket]))
+                continue
+
+            strict, sensitive = bucket
+            table = {}
+            for route in routes:
+                key = _static_key(route.static, strict, sensitive)
+                if key not in table or table[key].rank < route.rank:
+                    table[key] = route
+            self._buckets.append((bucket, (routes, table)))
+
+        self.static = tuple(
+            (bucket, table) for bucket, (_, table) in self._buckets)
+
+        mounts = {}
+        for route in mounted:
+            sensitive = bool(route.options.get('sensitive'))
+            table = mounts.setdefault(sensitive, {})
+            key = _static_key(route.mount, False, sensitive)
+            if key not in table or table[key].rank < route.rank:
+                table[key] = route
+        self.mounts = tuple(mounts.items())
+        self.mounted = tuple(sorted(mounted, key=lambda r: r.rank, reverse=True))
+        self.dynamic = tuple(sorted(dynamic, key=lambda r: r.rank, reverse=True))
+        self.order = self.dynamic if order is None else tuple(order)
+        self.next_index = max(r.index for r in self.routes) + 1 if self.routes else 0
+        # Only hold on to the previous table if its analysis can be reused.
+        if previous is not None and previous._overlaps is None:
+            previous = None
+        self._previous = previous
+        self._overlaps = None
+        self._blockers = None
+
+    def __len__(self):
+        return len(self.routes)
+
+    def _partition(self, previous=None):
+        methods = set()
+        for route in self.routes:
+            methods.update(route.methods or ())
+
+        # Each partition is built from the same partition of the previous
+        # table, so its index buckets and overlap analysis are reused too.
+        if previous is None or previous.methods is None:
+            old_any, old_methods, old_only = None, {}, {}
+        else:
+            old_any, old_methods, old_only = (
+                previous.any, previous.methods, previous.only)
+
+        self.any = RouteTable(
+            [r for r in self.routes if r.methods is None],
+            previous=old_any, partition=False, origins=self.origins)
+        self.methods = {}
+        self.only = {}
+        for method in methods:
+            self.methods[method] = RouteTable([
+                r for r in self.routes if r.methods is None or method in r.methods
+            ], previous=old_methods.get(method), partition=False,
+                origins=self.origins)
+            self.only[method] = RouteTable([
+                r for r in self.routes if r.methods and method in r.methods
+            ], previous=old_only.get(method), partition=False,
+                origins=self.origins)
+
+    def allowed(self, path, exclude=None):
+        """
+        Return the set of methods whose method specific routes match the path.
+
+        Routes for any method are not considered, nor is the `exclude` method,
+        so after `match(path, method)` failed, `allowed(path, method)` only
+        tries the routes not tried yet.
+
+        """
+        if self.methods is None:
+            return set()
+        if exclude is not None:
+            exclude = exclude.upper()
+        return set(
+            method for method, table in self.only.items()
+            if method != exclude and table.match(path) is not None
+        )
+
+    def reordered(self, order):
+        """
+        Return a copy of the table scanning dynamic routes in the given order.
+
+        """
+        import copy
+
+        table = copy.copy(self)
+        table.order = tuple(order)
+        return table
+
+    def overlaps(self):
+        """
+        Map each dynamic route to the set of dynamic routes it may overlap.
+
+        """
+        if self._overlaps is not None:
+            return self._overlaps
+
+        previous = self._previous
+        old = previous.overlaps() if previous is not None else {}
+        self._previous = None
+        # Overlaps only depend on paths and options, so they carry over to
+        # copies of the previous table's routes.
+        origins = self.origins
+        copies = dict((origin, route) for route, origin in origins.items())
+        added = [route for route in self.dynamic
+                 if origins.get(route, route) not in old]
+
+        overlaps = {}
+        current = frozenset(self.dynamic)
+        for route in self.dynamic:
+            overlaps[route] = set()
+            for other in old.get(origins.get(route, route), ()):
+                other = copies.get(other, other)
+                if other in current:
+                    overlaps[route].add(other)
+        # Routes with different literal first segments never overlap, so
+        # new routes are only compared to their segment's routes and to the
+        # routes without one.
+        segments = {}
+        spread = []
+        for route in self.dynamic:
+            if route.segment is None:
+                spread.append(route)
+            else:
+                segments.setdefault(route.segment, []).append(route)
+        for route in added:
+            if route.segment is None:
+                candidates = (self.dynamic,)
+            else:
+                candidates = (segments[route.segment], spread)
+            for others in candidates:
+                for other in others:
+                    if other is not route and not _disjoint(route, other):
+                        overlaps[route].add(other)
+                        overlaps[other].add(route)
+
+        self._overlaps = overlaps
+        return overlaps
+
+    def blockers(self):
+        """
+        For each dynamic route, the indexes of higher ranked routes it may
+        overlap.
+
+        """
+        if self._blockers is None:
+            overlaps = self.overlaps()
+            position = dict((route, i) for i, route in enumerate(self.dynamic))
+            self._blockers = [
+                [j for j in (position[other] for other in overlaps[route])
+                 if j < i]
+                for i, route in enumerate(self.dynamic)
+            ]
+        return self._blockers
+
+    def updated(self, routes, build):
+        """
+        Return a table for a new list of `(path, value, options)` tuples.
+
+        Routes are matched to existing ones by path and options; those keep
+        their compiled state, and only new routes are built, by passing a list
+        of `(path, value, options, index)` tuples to `build`. Every route is
+        indexed by its position in the new list, so the table ranks them like
+        a table built from scratch. Return the table and the numbers of added,
+        removed and reused routes.
+
+        Reused routes whose value or index changed are copies; the table's
+        `origins` maps them to the routes of this table they were copied from.
+
+        """
+        existing = {}
+        for old in self.routes:
+            existing.setdefault(old.key, []).append(old)
+
+        kept = []
+        pending = []
+        origins = {}
+        for index, (path, value, options) in enumerate(routes):
+            candidates = existing.get(_route_key(path, options))
+            if not candidates:
+                pending.append((path, value, options, index))
+                continue
+            old = candidates.pop(0)
+            route = old
+            if old.value != value or old.index != index:
+                route = old.with_value(value, index)
+                origins[route] = old
+            kept.append(route)
+
+        added = build(pending) if pending else []
+        removed = sum(len(candidates) for candidates in existing.values())
+        table = RouteTable(sorted(kept + added, key=lambda r: r.index),
+                           previous=self, origins=origins)
+        return table, len(added), removed, len(kept)
+
+    def match(self, path, method=None):
+        """
+        Match a path, returning a `(route, params)` tuple or `None`.
+
+        When a `method` is given, only routes allowing it are considered.
+        Methods are compared in upper case, like the routes' `methods`.
+
+        """
+        if method is not None and self.methods is not None:
+            return self.methods.get(method.upper(), self.any).match(path)
+
+        lower = _fold(path)
+        best = None
+        for (strict, sensitive), table in self.static:
+            route = table.get(
+                _static_key(path if sensitive else lower, strict, True))
+            if route is not None and (best is None or best.rank < route.rank):
+                best = route
+        for sensitive, table in self.mounts:
+            route = _mount_lookup(table, path if sensitive else lower)
+            if route is not None and (best is None or best.rank < route.rank):
+                best = route
+
+        if best is None:
+            for route in self.order:
+                params = route.match(path, lower)
+                if params is not None:
+                    return route, params
+            return None
+
+        for route in self.dynamic:
+            if route.rank < best.rank:
+                break
+            params = route.match(path, lower)
+            if params is not None:
+                return route, params
+        return best, {}
+
+
+class Reload(object):
+    """
+    The progress and outcome of a `Router.reload`.
+
+    `duration` is the build time in seconds, and `before` and `after` the
+    number of routes in the replaced and new tables, of which `added` were
+    compiled, `removed` dropped and `reused` carried over. `error` holds the
+    exception if building failed, in which case the old table is kept.
+    For `Router.load`, `sources` maps each source name to its read time.
+
+    """
+    def __init__(self, before):
+        import threading
+
+        self.before = before
+        self.sources = None
+        self.after = None
+        self.added = None
+        self.removed = None
+        self.reused = None
+        self.duration = None
+        self.error = None
+        self.done = threading.Event()
+
+    def __repr__(self):
+        return '<Reload %s -> %s routes in %ss>' % (
+            self.before, self.after, self.duration)
+
+    @property
+    def change(self):
+        """
+        The change in the number of routes, once the reload is done.
+
+        """
+        return None if self.after is None else self.after - self.before
+
+    def wait(self, timeout=None):
+        """
+        Block until the reload finished, re-raising any build error.
+
+        """
+        self.done.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self
+
+
+class Router(object):
+    """
+    Match paths against many routes, returning the most specific match.
+
+    Ambiguity between routes is resolved by their `specificity`, falling back
+    to registration order. Fully static routes are found with a dictionary
+    lookup; only the routes ranked above a static hit are tried against the
+    path.
+
+    Routes are held in an immutable `RouteTable`. Matching reads the current
+    `table` once and takes no locks; `add` builds a new table and publishes it
+    by replacing the attribute, serialized with other writers by a lock.
+
+    With `adaptive` enabled, hits are counted per route and every `interval`
+    matches the dynamic routes are rescanned in order of frequency. Routes are
+    only moved ahead of routes they are proven `_disjoint` from, so results are
+    unchanged.
+
+    Passing a `Metrics` instance instruments matching; without one the router
+    runs uninstrumented code. Likewise, a `slow` callback is only wrapped around
+    route matches and builds when given; it is called as `slow(path, pattern,
+    input, elapsed)` whenever one takes longer than `threshold` seconds.
+
+    Routers given the same `cache` mapping compile each distinct path and
+    options once and share the result; see `Registry`.
+
+    With `normalize` enabled, paths are cleaned up by `normalize_path` before
+    matching.
+
+    """
+    def __init__(self, options=None, adaptive=False, interval=1000,
+                 metrics=None, slow=None, threshold=0.001, cache=None,
+                 normalize=False):
+        import threading
+
+        self.options = options or {}
+        self.cache = cache
+        self.normalize = normalize
+        self.adaptive = adaptive
+        self.interval = interval
+        self.metrics = metrics
+        self.slow = slow
+        self.threshold = threshold
+        if metrics is not None:
+            self.match = self._instrumented_match
+        self.table = RouteTable()
+        self.hits = {}
+        self._lock = threading.Lock()
+        self._matches = 0
+
+    @property
+    def routes(self):
+        """
+        The routes of the current table, in registration order.
+
+        """
+        return self.table.routes
+
+    @property
+    def order(self):
+        """
+        The dynamic routes in the order they are currently scanned.
+
+        """
+        return list(self.table.order)
+
+    def route(self, path, value=None, options=None, index=0, compiled=None):
+        """
+        Build a `Route` with the router's options and hooks applied.
+
+        """
+        options = dict(self.options, **(options or {}))
+        if self.cache is None:
+            route = Route(path, value, options, index, compiled)
+        else:
+            key = _route_key(path, options)
+            origin = self.cache.get(key)
+            if origin is None:
+                origin = Route(path, None, options, 0, compiled)
+                self.cache[key] = origin
+            route = origin.with_value(value, index)
+            # Keeps the shared route alive in a weak cache.
+            route.origin = origin
+        return self._hook(route)
+
+    def _hook(self, route):
+        if self.metrics is not None:
+            route.match = self.metrics.timed(route)
+        if self.slow is not None:
+            route.match = self._watch(route, route.match)
+            route.build = self._watch(route, route.build)
+        return route
+
+    def add(self, path, value=None, options=None):
+        """
+        Add a path to the router, returning its `Route`.
+
+        """
+        return self.extend([(path, value, options)])[0]
+
+    def extend(self, routes):
+        """
+        Add `(path, value[, options])` tuples, publishing a single new table.
+
+        Return the list of new `Route` objects.
+
+        """
+        with self._lock:
+            table = self.table
+            added = self._routes(routes, table.next_index)
+            for route in added:
+                self.hits[route] = 0
+            self.table = self._analyzed(
+                RouteTable(table.routes + tuple(added), previous=table))
+        return added
+
+    def _analyzed(self, table):
+        # The overlap analysis of adaptive reordering runs here, on the
+        # writer's thread, rather than in the `match` that reorders.
+        if self.adaptive:
+            table.blockers()
+            if table.methods is not None:
+                table.any.blockers()
+                for partition in table.methods.values():
+                    partition.blockers()
+        return table
+
+    def _specs(self, routes):
+        for route in routes:
+            path, value, options = (tuple(route) + (None, None))[:3]
+            yield path, value, dict(self.options, **(options or {}))
+
+    def _routes(self, routes, index=0):
+        return self._build([
+            (path, value, options, index + i)
+            for i, (path, value, options) in enumerate(self._specs(routes))
+        ])
+
+    def _build(self, specs, processes=None):
+        compiled = [None] * len(specs)
+        if processes is not None and processes != 1 and len(specs) > 1:
+            compiled = bulk_compile(
+                [(path, options) for path, _, options, _ in specs], processes)
+        return [
+            self.route(path, value, options, index, compiled[i])
+            for i, (path, value, options, index) in enumerate(specs)
+        ]
+
+    def reload(self, routes, background=True, processes=None):
+        """
+        Replace all routes with `(path, value[, options])` tuples.
+
+        The new table is built, including parsing, pattern generation,
+        compilation and indexing, on a background thread while matching keeps
+        using the current table, then swapped in. Routes added in the meantime
+        are discarded. Return a `Reload` describing the rebuild; call its
+        `wait()` to block until the swap.
+
+        Only routes whose path or options changed are compiled; see
+        `RouteTable.updated`. With `processes`, they are compiled by
+        `bulk_compile` in that many worker processes (`0` for one per CPU).
+
+        """
+        return self._reload(lambda progress: routes, background, processes)
+
+    def load(self, sources, background=True, threads=None, processes=None):
+        """
+        Replace all routes with those read from many sources concurrently.
+
+        Sources are read by `load_sources` in a pool of `threads`, then the
+        routes are compiled as by `reload`, in `processes` when given. The
+        returned `Reload` has the read time of each source in `sources`.
+
+        """
+        def read(progress):
+            routes, progress.sources = load_sources(sources, threads)
+            return routes
+
+        return self._reload(read, background, processes)
+
+    def _reload(self, read, background, processes):
+        progress = Reload(len(self.table))
+
+        def build():
+            start = timer()
+            try:
+                routes = read(progress)
+                build = lambda specs: self._build(specs, processes)
+                table, progress.added, progress.removed, progress.reused = (
+                    self.table.updated(self._specs(routes), build))
+                self._analyzed(table)
+                for route in table.origins:
+                    self._hook(route)
+                with self._lock:
+                    hits = self.hits
+                    self.hits = dict(
+                        (route, hits.get(table.origins.get(route, route), 0))
+                        for route in table.routes)
+                    removed = self.table.routes
+                    self.table = table
+                if self.metrics is not None:
+                    keys = set(route.key for route in table.routes)
+                    self.metrics.forget(
+                        route for route in removed if route.key not in keys)
+            except Exception as error:
+                progress.error = error
+            else:
+                progress.after = len(table)
+            progress.duration = timer() - start
+            progress.done.set()
+
+        if background:
+            import threading
+            thread = threading.Thread(target=build, name='repath-reload')
+            thread.daemon = True
+            thread.start()
+        else:
+            build()
+        return progress
+
+    def reorder(self):
+        """
+        Reorder the dynamic route scan by hit count.
+
+        A route is never scanned before a higher ranked route it may overlap.
+
+        """
+        with self._lock:
+            self._reorder()
+
+    def _reorder(self):
+        table = self.table
+        reordered = table.reordered(self._order(table))
+        if table.methods is not None:
+            reordered.any = table.any.reordered(self._order(table.any))
+            reordered.methods = dict(
+                (method, partition.reordered(self._order(partition)))
+                for method, partition in table.methods.items())
+        self.table = reordered
+
+    def _order(self, table):
+        dynamic = table.dynamic
+        blockers = table.blockers()
+
+        waiting = [len(b) for b in blockers]
+        blocks = [[] for _ in dynamic]
+        for i, b in enumerate(blockers):
+            for j in b:
+                blocks[j].append(i)
+
+        hits = self.hits
+        ready = [
+            (-hits.get(route, 0), i) for i, route in enumerate(dynamic)
+            if not waiting[i]
+        ]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            _, i = heapq.heappop(ready)
+            order.append(dynamic[i])
+            for j in blocks[i]:
+                waiting[j] -= 1
+                if not waiting[j]:
+                    heapq.heappush(ready, (-hits.get(dynamic[j], 0), j))
+        return order
+
+    def match(self, path, method=None):
+        """
+        Match a path, returning a `(route, params)` tuple or `None`.
+
+        When a `method` is given, only routes allowing it are considered.
+
+        """
+        if self.normalize:
+            path = _normalized(path)
+        result = self.table.match(path, method)
+
+        if self.adaptive and result is not None:
+            self.hits[result[0]] = self.hits.get(result[0], 0) + 1
+            self._matches += 1
+            if not self._matches % self.interval:
+                # Skip this round rather than wait for a concurrent writer.
+                if self._lock.acquire(False):
+                    try:
+                        self._reorder()
+                    finally:
+                        self._lock.release()
+
+        return result
+
+    def _watch(self, route, function):
+        slow, threshold = self.slow, self.threshold
+
+        def watched(value=None, *args):
+            start = timer()
+            result = function(value, *args)
+            elapsed = timer() - start
+            if elapsed > threshold:
+                slow(route.path, route.pattern, value, elapsed)
+            return result
+
+        return watched
+
+    def allowed(self, path, exclude=None):
+        """
+        Return the set of methods with a method specific route for the path.
+
+        Use it to build the `Allow` header of a 405 response after
+        `match(path, method)` failed, passing that method as `exclude`.
+
+        """
+        if self.normalize:
+            path = _normalized(path)
+        return self.table.allowed(path, exclude)
+
+    def _instrumented_match(self, path, method=None):
+        metrics = self.metrics
+        metrics.tried = 0
+        start = timer()
+        result = Router.match(self, path, method)
+
+        if result is not None:
+            if result[0].static is not None or result[0].mount is not None:
+                metrics.observe(result[0], timer() - start, True)
+                metrics.tried += 1
+            metrics.observe_tried(metrics.tried)
+
+        return result
+
+
+def _sizeof(route):
+    """
+    Estimate the memory held by a route's compiled state, in bytes.
+
+    """
+    size = sys.getsizeof(route.pattern) + sys.getsizeof(route.regexp)
+    size += sys.getsizeof(route.regexp.groupindex)
+    size += sys.getsizeof(route.names) + sys.getsizeof(route.keys)
+    for token in route.tokens or ():
+        size += sys.getsizeof(token)
+        if isinstance(token, dict):
+            size += sum(sys.getsizeof(value) for value in token.values())
+    return size
+
+
+class Registry(object):
+    """
+    Route tables for many tenants, sharing identical routes between them.
+
+    Each tenant has its own `Router`; routes with the same path and options
+    are parsed and compiled once, and tenants' tables only hold lightweight
+    copies of them carrying the tenant's value and registration order. Shared
+    routes are dropped once no tenant uses them.
+
+    """
+    def __init__(self, options=None, **kwargs):
+        self.options = options
+        self.kwargs = kwargs
+        import weakref
+
+        self.cache = weakref.WeakValueDictionary()
+        self.routers = {}
+
+    def __contains__(self, tenant):
+        return tenant in self.routers
+
+    def router(self, tenant):
+        """
+        Return the tenant's `Router`, creating it if needed.
+
+        """
+        router = self.routers.get(tenant)
+        if router is None:
+            router = Router(self.options, cache=self.cache, **self.kwargs)
+            self.routers[tenant] = router
+        return router
+
+    def load(self, tenant, routes):
+        """
+        Replace a tenant's routes with `(path, value[, options])` tuples.
+
+        """
+        return self.router(tenant).reload(routes, background=False).wait()
+
+    def remove(self, tenant):
+        """
+        Remove a tenant and its routes.
+
+        """
+        del self.routers[tenant]
+
+    def match(self, tenant, path, method=None):
+        """
+        Match a path against a tenant's routes.
+
+        Return a `(route, params)` tuple, or `None` if nothing (or no tenant)
+        matches.
+
+        """
+        router = self.routers.get(tenant)
+        return router.match(path, method) if router is not None else None
+
+    def stats(self):
+        """
+        Report how much compiled state the tenants share.
+
+        `routes` counts routes over all tenants and `shared` the distinct
+        compiled routes behind them; `bytes` estimates the memory held by the
+        compiled state, and `unshared_bytes` what it would be with a separate
+        copy per tenant route.
+
+        """
+        routes = 0
+        sizes = {}
+        unshared = 0
+        for router in self.routers.values():
+            for route in router.routes:
+                origin = getattr(route, 'origin', route)
+                if id(origin) not in sizes:
+                    sizes[id(origin)] = _sizeof(origin)
+                routes += 1
+                unshared += sizes[id(origin)]
+
+        shared = sum(sizes.values())
+        return {
+            'tenants': len(self.routers),
+            'routes': routes,
+            'shared': len(sizes),
+            'bytes': shared,
+            'unshared_bytes': unshared,
+            'saved_bytes': unshared - shared,
+        }
+
+
+def _not_found(environ, start_response):
+    allowed = environ.get('repath.allowed')
+    if allowed:
+        headers = [('Allow', ', '.join(sorted(allowed)))]
+        status = '405 Method Not Allowed'
+    else:
+        headers = []
+        status = '404 Not Found'
+    start_response(status, headers + [
+        ('Content-Type', 'text/plain'), ('Content-Length', str(len(status))),
+    ])
+    return [status]
+
+
+class WSGIMiddleware(object):
+    """
+    WSGI application dispatching requests through a `Router`.
+
+    The request's `PATH_INFO` and `REQUEST_METHOD` are matched and the result
+    is stored in the environ as `repath.route` and `repath.params` (both `None`
+    without a match), along with the routing time in seconds as `repath.time`.
+    The request is then passed to the matched route's value, which must be a
+    WSGI application, or to `default` when nothing matches. The default
+    `default` responds with a 404, or a 405 listing `repath.allowed` methods.
+
+    When given, `timing` is called as `timing(path, result, elapsed)` after
+    every match.
+
+    """
+    def __init__(self, router, default=None, timing=None):
+        self.router = router
+        self.default = default or _not_found
+        self.timing = timing
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO') or '/'
+        method = environ.get('REQUEST_METHOD')
+
+        start = timer()
+        result = self.router.match(path, method)
+        elapsed = timer() - start
+
+        environ['repath.time'] = elapsed
+        if self.timing is not None:
+            self.timing(path, result, elapsed)
+
+        if result is None:
+            environ['repath.route'] = environ['repath.params'] = None
+            environ['repath.allowed'] = self.router.allowed(path, method)
+            return self.default(environ, start_response)
+
+        environ['repath.route'], environ['repath.params'] = result
+        return result[0].value(environ, start_response)
+
+
+class ASGIMiddleware(object):
+    """
+    ASGI application dispatching requests through a `Router`.
+
+    Works like `WSGIMiddleware`, matching `scope['path']` and `scope['method']`
+    of HTTP and WebSocket connections and storing the result in a copy of the
+    scope, as ASGI requires of middleware.
+    Other connections, such as lifespan events, and unmatched requests are
+    passed to the `default` application, which is required.
+
+    """
+    def __init__(self, router, default, timing=None):
+        self.router = router
+        self.default = default
+        self.timing = timing
+
+    def __call__(self, scope, receive, send):
+        if scope['type'] not in ('http', 'websocket'):
+            return self.default(scope, receive, send)
+
+        path = scope['path']
+        method = scope.get('method')
+
+        start = timer()
+        result = self.router.match(path, method)
+        elapsed = timer() - start
+
+        if self.timing is not None:
+            self.timing(path, result, elapsed)
+
+        if result is None:
+            scope = dict(scope, **{
+                'repath.route': None, 'repath.params': None,
+                'repath.time': elapsed,
+                'repath.allowed': self.router.allowed(path, method),
+            })
+            return self.default(scope, receive, send)
+
+        scope = dict(scope, **{
+            'repath.route': result[0], 'repath.params': result[1],
+            'repath.time': elapsed,
+        })
+        return result[0].value(scope, receive, send)
+
+
+def _label(value):
+    value = value if isinstance(value, basestring) else str(value)
+    if isinstance(value, unicode):
+        value = value.encode('utf8')
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics(object):
+    """
+    Per-route match instrumentation for a `Router`.
+
+    Records attempts, hits, misses and a match time histogram for every route,
+    and a histogram of the number of routes tried before each hit.
+
+    Statistics are kept by route `key`, so they carry over to the copies a
+    reload makes of unchanged routes, and are reported with the path and
+    index of the route last instrumented for the key. `forget` drops them
+    when routes are removed.
+
+    """
+    TIME_BUCKETS = (
+        1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 1e-3, 1e-2,
+    )
+    TRIED_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+    def __init__(self, time_buckets=None, tried_buckets=None):
+        import threading
+
+        self.time_buckets = tuple(time_buckets or self.TIME_BUCKETS)
+        self.tried_buckets = tuple(tried_buckets or self.TRIED_BUCKETS)
+        # The route last instrumented for each key, and its statistics.
+        self.routes = {}
+        self._stats = {}
+        self._local = threading.local()
+        # Histogram buckets followed by the sum of routes tried.
+        self._tried = [0] * (len(self.tried_buckets) + 2)
+
+    @property
+    def tried(self):
+        """
+        The routes tried by the match in progress on the calling thread.
+
+        """
+        return getattr(self._local, 'tried', 0)
+
+    @tried.setter
+    def tried(self, tried):
+        self._local.tried = tried
+
+    def timed(self, route):
+        """
+        Return an instrumented replacement for `route.match`.
+
+        """
+        plain = route.match
+        self.routes[route.key] = route
+        if route.key not in self._stats:
+            # [hits, misses, time sum] followed by the histogram buckets.
+            self._stats[route.key] = (
+                [0, 0, 0.0] + [0] * (len(self.time_buckets) + 1))
+
+        def match(path, lower=None):
+            start = timer()
+            params = plain(path, lower)
+            self.observe(route, timer() - start, params is not None)
+            self.tried += 1
+            return params
+
+        return match
+
+    def observe(self, route, elapsed, hit):
+        """
+        Record a single match attempt of the route.
+
+        """
+        stats = self._stats.get(route.key)
+        if stats is None:
+            # The route was removed while it was being matched.
+            return
+        stats[0 if hit else 1] += 1
+        stats[2] += elapsed
+        stats[3 + bisect.bisect_left(self.time_buckets, elapsed)] += 1
+
+    def forget(self, routes):
+        """
+        Drop the statistics of routes that were removed.
+
+        """
+        for route in routes:
+            self.routes.pop(route.key, None)
+            self._stats.pop(route.key, None)
+
+    def observe_tried(self, tried):
+        """
+        Record the number of routes tried before a hit.
+
+        """
+        self._tried[bisect.bisect_left(self.tried_buckets, tried)] += 1
+        self._tried[-1] += tried
+
+    def snapshot(self):
+        """
+        Return the collected metrics as a dictionary.
+
+        """
+        routes = []
+        for route in sorted(self.routes.values(), key=lambda r: r.index):
+            stats = self._stats[route.key]
+            routes.append({
+                'id': route.index,
+                'route': route.path if isinstance(route.path, basestring)
+                else repr(route.path),
+                'pattern': route.pattern,
+                'attempts': stats[0] + stats[1],
+                'hits': stats[0],
+                'misses': stats[1],
+                'seconds': stats[2],
+                'buckets': list(zip(self.time_buckets + (float('inf'),),
+                                    stats[3:])),
+            })
+
+        return {
+            'routes': routes,
+            'tried': {
+                'count': sum(self._tried[:-1]),
+                'sum': self._tried[-1],
+                'buckets': list(zip(self.tried_buckets + (float('inf'),),
+                                    self._tried[:-1])),
+            },
+        }
+
+    def prometheus(self):
+        """
+        Return the collected metrics in the Prometheus text format.
+
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        for name, key, text in (
+            ('attempts', 'attempts', 'Match attempts per route.'),
+            ('hits', 'hits', 'Successful matches per route.'),
+            ('misses', 'misses', 'Failed matches per route.'),
+        ):
+            lines.append('# HELP repath_route_%s_total %s' % (name, text))
+            lines.append('# TYPE repath_route_%s_total counter' % name)
+            for route in snapshot['routes']:
+                lines.append('repath_route_%s_total{id="%d",route="%s"} %d' % (
+                    name, route['id'], _label(route['route']), route[key]))
+
+        def histogram(name, labels, buckets, total, count):
+            cumulative = 0
+            for bound, value in buckets:
+                cumulative += value
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('%s_bucket{%s} %d' % (
+                    name, ','.join(labels + ['le="%s"' % le]), cumulative))
+            suffix = '{%s}' % ','.join(labels) if labels else ''
+            lines.append('%s_sum%s %r' % (name, suffix, total))
+            lines.append('%s_count%s %d' % (name, suffix, count))
+
+        lines.append('# HELP repath_route_match_seconds Match time per route.')
+        lines.append('# TYPE repath_route_match_seconds histogram')
+        for route in snapshot['routes']:
+            labels = ['id="%d"' % route['id'], 'route="%s"' % _label(route['route'])]
+            histogram('repath_route_match_seconds', labels, route['buckets'],
+                      route['seconds'], route['attempts'])
+
+        tried = snapshot['tried']
+        lines.append('# HELP repath_routes_tried Routes tried before each hit.')
+        lines.append('# TYPE repath_routes_tried histogram')
+        histogram('repath_routes_tried', [], tried['buckets'], tried['sum'],
+                  tried['count'])
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        """
+        Atomically write the Prometheus text format to a local file.
+
+        """
+        temp = '%s.%d.tmp' % (filename, os.getpid())
+        with open(temp, 'w') as handle:
+            handle.write(self.prometheus())
+        os.rename(temp, filename)
+
+
+class _LazyStruct(object):
+    """
+    A `struct.Struct` that is only created when first used, like
+    `_LazyRegexp`, so `struct` is not imported until a table is mapped.
+
+    """
+    def __init__(self, format):
+        self._format = format
+        self._struct = None
+
+    def __getattr__(self, name):
+        if self._struct is None:
+            import struct
+            self._struct = struct.Struct(self._format)
+        value = getattr(self._struct, name)
+        setattr(self, name, value)
+        return value
+
+
+TABLE_MAGIC = b'REPATH\x00\x01'
+TABLE_HEADER = _LazyStruct('<8sIIIIIIII')
+TABLE_ROUTE = _LazyStruct('<IIIIIIIIiB3x6i')
+TABLE_TOKEN = _LazyStruct('<B3x8I')
+TABLE_SLOT = _LazyStruct('<IIII')
+TABLE_BUCKETS = ((False, False), (False, True), (True, False), (True, True))
+TABLE_NONE = 0xFFFFFFFF
+
+
+def _utf8(string):
+    return string.encode('utf8') if isinstance(string, unicode) else string
+
+
+def _text(data):
+    try:
+        data.decode('ascii')
+    except UnicodeDecodeError:
+        return data.decode('utf8')
+    return data
+
+
+def dump_table(table, filename):
+    """
+    Write a `RouteTable` to a file in a flat format for `MappedRouteTable`.
+
+    Routes must have string paths, values that are strings or `None` and no
+    `methods`. Text is stored as UTF-8 and read back as `unicode` when not ASCII. The
+    file is written to a temporary name and renamed into place.
+
+    """
+    import struct
+    import zlib
+
+    strings = []
+    offsets = {}
+    size = [0]
+
+    def string(value):
+        if value is None:
+            return TABLE_NONE, 0
+        data = _utf8(value)
+        if data not in offsets:
+            offsets[data] = size[0]
+            strings.append(data)
+            size[0] += len(data)
+        return offsets[data], len(data)
+
+    routes = []
+    tokens = []
+    for route in table.routes:
+        if route.tokens is None:
+            raise TypeError('Expected a string path, got %r' % (route.path,))
+        if route.value is not None and not isinstance(route.value, basestring):
+            raise TypeError('Expected a string value for %r' % (route.path,))
+        if route.methods is not None or any(
+                'converter' in token for token in route.tokens
+                if not isinstance(token, basestring)):
+            raise TypeError('Expected no methods or converters for %r' % (
+                route.path,))
+
+        first = len(tokens)
+        for token in route.tokens:
+            if isinstance(token, basestring):
+                tokens.append(TABLE_TOKEN.pack(
+                    0, *(string(token) + (0,) * 6)))
+                continue
+            bits = 1 | token['optional'] << 1 | token['repeat'] << 2
+            tokens.append(TABLE_TOKEN.pack(bits, *(
+                string(token['name']) + string(token['prefix']) +
+                string(token['delimiter']) + string(token['pattern']))))
+
+        options = route.options
+        bits = (
+            bool(options.get('strict')) |
+            (options.get('end') == False) << 1 |
+            bool(options.get('sensitive')) << 2 |
+            bool(options.get('decode')) << 3
+        )
+        routes.append(TABLE_ROUTE.pack(*(
+            string(route.path) + string(route.pattern) + string(route.value) +
+            (first, len(route.tokens), route.index, bits) +
+            tuple(int(score) for score in route.score))))
+
+    positions = dict((route, i) for i, route in enumerate(table.routes))
+    sections = []
+    for bucket in TABLE_BUCKETS:
+        index = dict(table.static).get(bucket, {})
+        count = 1 if index else 0
+        while count < 2 * len(index):
+            count *= 2
+        slots = [None] * count
+        for key, route in index.items():
+            data = _utf8(key)
+            hashed = zlib.crc32(data) & 0xFFFFFFFF
+            slot = hashed & (count - 1)
+            while slots[slot] is not None:
+                slot = (slot + 1) & (count - 1)
+            slots[slot] = TABLE_SLOT.pack(
+                hashed, positions[route] + 1, *string(key))
+        sections.append(b''.join(
+            slot or TABLE_SLOT.pack(0, 0, 0, 0) for slot in slots))
+
+    # Mapped tables scan mounted routes along with the dynamic ones.
+    scanned = sorted(table.dynamic + table.mounted, key=lambda r: r.rank,
+                     reverse=True)
+    dynamic = struct.pack(
+        '<%dI' % len(scanned), *[positions[r] for r in scanned])
+    body = [b''.join(routes), b''.join(tokens), dynamic, None]
+    body.extend(sections)
+    body.append(b''.join(strings))
+
+    # Lay out the sections, leaving room for the static index directory.
+    starts = []
+    position = TABLE_HEADER.size
+    for part in body:
+        starts.append(position)
+        position += len(part) if part is not None else 8 * len(sections)
+    body[3] = b''.join(
+        struct.pack('<II', len(section) // TABLE_SLOT.size, start)
+        for section, start in zip(sections, starts[4:-1]))
+
+    header = TABLE_HEADER.pack(
+        TABLE_MAGIC, len(routes), len(tokens), len(scanned),
+        starts[0], starts[1], starts[2], starts[3], starts[-1])
+
+    temp = '%s.%d.tmp' % (filename, os.getpid())
+    with open(temp, 'wb') as handle:
+        handle.write(header)
+        for part in body:
+            handle.write(part)
+    os.rename(temp, filename)
+
+
+class MappedRoute(object):
+    """
+    A route of a `MappedRouteTable`, decoded from the mapping on demand.
+
+    Only the regular expression and parameter names are held in process
+    memory, compiled the first time the route is tried.
+
+    """
+    __slots__ = ('table', 'id', 'index', 'rank', 'options', '_fields',
+                 '_regexp', '_names')
+
+    def __init__(self, table, id):
+        fields = TABLE_ROUTE.unpack_from(
+            table.data, table.routes + id * TABLE_ROUTE.size)
+        bits = fields[9]
+        self.table = table
+        self.id = id
+        self.index = fields[8]
+        score = (fields[10], bool(fields[11])) + fields[12:]
+        self.rank = score, -fields[8]
+        self.options = {
+            'strict': bool(bits & 1),
+            'end': not bits & 2,
+            'sensitive': bool(bits & 4),
+            'decode': bool(bits & 8),
+        }
+        self._fields = fields
+        self._regexp = None
+        self._names = None
+
+    def __repr__(self):
+        return '<MappedRoute %r>' % (self.path,)
+
+    @property
+    def path(self):
+        return self.table.string(*self._fields[0:2])
+
+    @property
+    def pattern(self):
+        return self.table.string(*self._fields[2:4])
+
+    @property
+    def value(self):
+        return self.table.string(*self._fields[4:6])
+
+    @property
+    def tokens(self):
+        first, count = self._fields[6:8]
+        return [self.table.token(i) for i in range(first, first + count)]
+
+    @property
+    def regexp(self):
+        if self._regexp is None:
+            flags = 0 if self.options['sensitive'] else re.I
+            self._regexp = re.compile(self.pattern, flags)
+            self._names = [
+                token['name'] for token in self.tokens
+                if not isinstance(token, basestring)
+            ]
+        return self._regexp
+
+    def match(self, path):
+        """
+        Match the path, returning a dictionary of parameters or `None`.
+
+        """
+        match = self.regexp.match(path)
+        if match is None:
+            return None
+        params = dict(zip(self._names, match.groups()))
+        if self.options['decode']:
+            _decode_params(params)
+        return params
+
+    def build(self, params=None):
+        """
+        Build a path for the route from a dictionary of parameters.
+
+        """
+        return tokens_to_function(self.tokens)(params)
+
+
+class MappedRouteTable(object):
+    """
+    A read-only route table mapped from a file written by `dump_table`.
+
+    The routes, tokens, strings and static index are read straight from the
+    memory map, so processes mapping the same file share them through the
+    page cache; each process only holds the routes it has decoded.
+
+    """
+    def __init__(self, filename):
+        import mmap
+        import struct
+        import zlib
+
+        self._crc32 = zlib.crc32
+        with open(filename, 'rb') as handle:
+            self.data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, count, _, dynamic, self.routes, self.tokens, dynamic_offset,
+         buckets, self.strings) = TABLE_HEADER.unpack_from(self.data)
+        if magic != TABLE_MAGIC:
+            raise ValueError('Expected a repath route table in %r' % filename)
+
+        self.count = count
+        self.dynamic = struct.unpack_from(
+            '<%dI' % dynamic, self.data, dynamic_offset)
+        self.static = []
+        for i, bucket in enumerate(TABLE_BUCKETS):
+            slots, offset = struct.unpack_from('<II', self.data, buckets + 8 * i)
+            if slots:
+                self.static.append((bucket, slots, offset))
+        self._routes = {}
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.data.close()
+
+    def string(self, offset, length):
+        if offset == TABLE_NONE:
+            return None
+        start = self.strings + offset
+        return _text(self.data[start:start + length])
+
+    def token(self, i):
+        fields = TABLE_TOKEN.unpack_from(
+            self.data, self.tokens + i * TABLE_TOKEN.size)
+        bits = fields[0]
+        if not bits & 1:
+            return self.string(*fields[1:3])
+        return {
+            'name': self.string(*fields[1:3]),
+            'prefix': self.string(*fields[3:5]),
+            'delimiter': self.string(*fields[5:7]),
+            'optional': bool(bits & 2),
+            'repeat': bool(bits & 4),
+            'pattern': self.string(*fields[7:9]),
+        }
+
+    def route(self, id):
+        """
+        Return the `MappedRoute` at position `id`.
+
+        """
+        route = self._routes.get(id)
+        if route is None:
+            route = self._routes[id] = MappedRoute(self, id)
+        return route
+
+    def _lookup(self, path, strict, sensitive, slots, offset):
+        data = _utf8(_static_key(path, strict, sensitive))
+        hashed = self._crc32(data) & 0xFFFFFFFF
+        slot = hashed & (slots - 1)
+        while True:
+            stored, id, key, length = TABLE_SLOT.unpack_from(
+                self.data, offset + slot * TABLE_SLOT.size)
+            if not id:
+                return None
+            if stored == hashed:
+                start = self.strings + key
+                if self.data[start:start + length] == data:
+                    return self.route(id - 1)
+            slot = (slot + 1) & (slots - 1)
+
+    def match(self, path):
+        """
+        Match a path, returning a `(route, params)` tuple or `None`.
+
+        """
+        best = None
+        for (strict, sensitive), slots, offset in self.static:
+            route = self._lookup(path, strict, sensitive, slots, offset)
+            if route is not None and (best is None or best.rank < route.rank):
+                best = route
+
+        for id in self.dynamic:
+            route = self.route(id)
+            if best is not None and route.rank < best.rank:
+                break
+            params = route.match(path)
+            if params is not None:
+                return route, params
+
+        if best is not None:
+            return best, {}
+        return None
@@ -13,6 +13,9 @@ setup(
     ),
     packages=[],
     py_modules=['repath'],
+    extras_require={
+        'numpy': ['numpy'],
+    },
     keywords='url path pattern regex express route',
     license='MIT',
     classifiers=[
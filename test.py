@@ -1,8 +1,21 @@
+import gc
+import io
+import os
+import random
 import re
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
 
 import nose.tools
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 import repath
 
 def flags(options):
@@ -1784,3 +1797,1326 @@ class CompileErrorTests(unittest.TestCase):
         self.check_to_path(
             '/:foo(\\d+)+', {'foo': [1, 2, 3, 'a']},
             ValueError, 'Expected all "foo" to match "\\d+"')
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class BatchMatchTests(unittest.TestCase):
+    def test_should_agree_with_linear_regex_scan(self):
+        routes = [case[0] for case in TEST_CASES
+                  if isinstance(case[0], basestring) and case[0]]
+        paths = [match[0] for case in TEST_CASES if len(case) > 3
+                 for match in case[3]]
+        paths.extend(['', 'route', '/unknown/deep/path/'])
+
+        for options in (None, {'strict': True}, {'end': False}):
+            regexps = [re.compile(repath.path_to_pattern(r, [], options), re.I)
+                       for r in routes]
+            expected = []
+            for path in paths:
+                matches = [i for i, r in enumerate(regexps) if r.match(path)]
+                expected.append(matches[0] if matches else -1)
+
+            result = repath.batch_match(paths, routes, options, re.I)
+            self.assertEqual(list(result), expected)
+
+    def test_should_return_empty_array_for_empty_batch(self):
+        self.assertEqual(len(repath.batch_match([], ['/foo'])), 0)
+
+
+class SpecificityTests(unittest.TestCase):
+    def score(self, path, options=None):
+        return repath.specificity(repath.parse(path), options)
+
+    def test_should_rank_static_segments_first(self):
+        self.assertGreater(self.score('/user/me'), self.score('/user/:id'))
+        self.assertGreater(self.score('/user/:id'), self.score('/:type/:id'))
+
+    def test_should_rank_custom_patterns_above_default(self):
+        self.assertGreater(self.score('/:id(\\d+)'), self.score('/:id'))
+
+    def test_should_rank_optional_repeat_and_asterisk_last(self):
+        self.assertGreater(self.score('/:id'), self.score('/:id?'))
+        self.assertGreater(self.score('/:id?'), self.score('/:id+'))
+        self.assertGreater(self.score('/:id+'), self.score('/*'))
+
+    def test_should_rank_full_matches_above_partial(self):
+        self.assertGreater(self.score('/foo'), self.score('/foo', {'end': False}))
+
+
+class RouterTests(unittest.TestCase):
+    ROUTES = [
+        '/*',
+        '/:type/:id',
+        '/user/:id+',
+        '/user/:id',
+        '/user/:id(\\d+)',
+        '/user/me',
+        '/user/me/',
+        '/user/:id.:ext',
+        '/(\\d+)',
+    ]
+    PATHS = [
+        '/', '/user', '/user/', '/user/me', '/USER/ME', '/user/me/',
+        '/user/12', '/user/bob', '/user/bob/12', '/user/bob.json',
+        '/123', '/post/1', '/a/b/c',
+    ]
+
+    def test_should_return_most_specific_route_regardless_of_order(self):
+        for routes in (self.ROUTES, list(reversed(self.ROUTES))):
+            router = repath.Router()
+            for path in routes:
+                router.add(path, path)
+
+            for path in self.PATHS:
+                candidates = [r for r in router.routes
+                              if r.match(path) is not None]
+                expected = max(candidates, key=lambda r: r.rank)
+                route, params = router.match(path)
+                self.assertIs(route, expected, path)
+                self.assertEqual(params, expected.match(path))
+
+    def test_should_prefer_dynamic_routes_ranked_above_static_hit(self):
+        router = repath.Router()
+        static = router.add('/a/b/')
+        dynamic = router.add('/a/b/(\\d*)')
+        self.assertIs(router.match('/a/b/')[0], dynamic)
+        self.assertIs(router.match('/a/b')[0], static)
+
+    def test_should_match_literals_ending_in_double_slashes(self):
+        router = repath.Router()
+        route = router.add('/a//')
+        strict = router.add('/b//', None, {'strict': True})
+
+        for path in ['/a/', '/a//', '/a', '/b//', '/b/']:
+            expected = route if route.regexp.match(path) else (
+                strict if strict.regexp.match(path) else None)
+            result = router.match(path)
+            self.assertIs(result and result[0], expected, path)
+        self.assertIsNotNone(strict.static)
+
+    def test_should_return_named_and_unnamed_params(self):
+        router = repath.Router()
+        router.add('/:foo/(\\d+)')
+        route, params = router.match('/test/42')
+        self.assertEqual(params, {'foo': 'test', '0': '42'})
+
+    def test_should_return_none_without_match(self):
+        router = repath.Router()
+        router.add('/foo')
+        self.assertIsNone(router.match('/bar'))
+
+    def test_should_respect_strict_and_sensitive_options(self):
+        router = repath.Router({'strict': True, 'sensitive': True})
+        route = router.add('/foo')
+        self.assertIs(router.match('/foo')[0], route)
+        self.assertIsNone(router.match('/foo/'))
+        self.assertIsNone(router.match('/FOO'))
+
+
+class AdaptiveRouterTests(unittest.TestCase):
+    def test_should_match_like_static_order_after_reordering(self):
+        plain = repath.Router()
+        adaptive = repath.Router(adaptive=True, interval=3)
+        for path in RouterTests.ROUTES:
+            plain.add(path)
+            adaptive.add(path)
+
+        for path in reversed(RouterTests.PATHS * 5):
+            expected = plain.match(path)
+            result = adaptive.match(path)
+            self.assertEqual(result[0].index, expected[0].index, path)
+            self.assertEqual(result[1], expected[1])
+
+    def test_should_move_hot_disjoint_routes_first(self):
+        router = repath.Router(adaptive=True, interval=10)
+        cold = router.add('/users/:id')
+        hot = router.add('/posts/:id')
+        self.assertEqual(router.order, [cold, hot])
+
+        for _ in range(10):
+            router.match('/posts/1')
+
+        self.assertEqual(router.hits[hot], 10)
+        self.assertEqual(router.order, [hot, cold])
+
+    def test_should_not_move_routes_ahead_of_overlapping_routes(self):
+        router = repath.Router(adaptive=True, interval=10)
+        specific = router.add('/:type/:id(\\d+)')
+        general = router.add('/:type/:id')
+
+        for _ in range(10):
+            self.assertIs(router.match('/posts/abc')[0], general)
+
+        self.assertEqual(router.order, [specific, general])
+        self.assertIs(router.match('/posts/1')[0], specific)
+
+    def test_should_analyze_overlaps_when_routes_are_added(self):
+        router = repath.Router(adaptive=True)
+        router.extend([('/users/:id',), ('/users/:id/posts',), ('/:page',)])
+        table = router.table
+        self.assertIsNotNone(table._blockers)
+
+        router.add('/posts/:id')
+        self.assertIsNotNone(router.table._blockers)
+        self.assertIsNone(router.table._previous)
+
+    def test_should_find_the_same_overlaps_as_comparing_every_pair(self):
+        rand = random.Random(1)
+        parts = ['users', 'Users', 'posts', ':id%d', ':id%d(\\d+)', ':name%d?',
+                 ':path%d*', 'a.:ext%d', 'us:x%d']
+        router = repath.Router(adaptive=True)
+        for _ in range(5):
+            router.extend([
+                ('/' + '/'.join(rand.choice(parts).replace('%d', str(depth))
+                                for depth in range(rand.randint(1, 3))),
+                 None, {'sensitive': rand.random() < 0.5})
+                for _ in range(20)
+            ])
+
+        dynamic = router.table.dynamic
+        overlaps = router.table.overlaps()
+        for route in dynamic:
+            self.assertEqual(overlaps[route], set(
+                other for other in dynamic if other is not route and
+                not repath._disjoint(route, other)), route.path)
+
+    def test_should_reorder_method_partitions(self):
+        router = repath.Router(adaptive=True, interval=10)
+        cold = router.add('/users/:id', None, {'methods': ['GET']})
+        hot = router.add('/posts/:id')
+        get = router.table.methods['GET']
+        self.assertEqual(list(get.order), [cold, hot])
+
+        for _ in range(10):
+            self.assertIs(router.match('/posts/1', 'GET')[0], hot)
+
+        self.assertEqual(list(router.table.methods['GET'].order), [hot, cold])
+        self.assertEqual(list(router.table.any.order), [hot])
+        self.assertIs(router.match('/users/1', 'GET')[0], cold)
+
+
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        self.metrics = repath.Metrics()
+        self.router = repath.Router(metrics=self.metrics)
+        self.static = self.router.add('/about')
+        self.user = self.router.add('/user/:id')
+        self.post = self.router.add('/post/:id')
+
+    def test_should_record_attempts_hits_and_misses(self):
+        self.router.match('/post/1')
+        self.router.match('/about')
+        self.router.match('/nope')
+
+        routes = dict((r['route'], r) for r in self.metrics.snapshot()['routes'])
+        self.assertEqual(routes['/post/:id']['hits'], 1)
+        self.assertEqual(routes['/post/:id']['misses'], 1)
+        self.assertEqual(routes['/user/:id']['attempts'], 2)
+        self.assertEqual(routes['/user/:id']['misses'], 2)
+        self.assertEqual(routes['/about']['hits'], 1)
+        self.assertEqual(sum(c for _, c in routes['/user/:id']['buckets']), 2)
+
+    def test_should_record_routes_tried_before_hit(self):
+        self.router.match('/post/1')
+        self.router.match('/about')
+
+        tried = self.metrics.snapshot()['tried']
+        self.assertEqual(tried['count'], 2)
+        self.assertEqual(tried['sum'], 3)
+
+    def test_should_count_routes_tried_per_thread(self):
+        metrics = repath.Metrics()
+        router = repath.Router(metrics=metrics)
+
+        def interleave(value):
+            # Run a whole match on another thread in the middle of this one.
+            thread = threading.Thread(target=router.match, args=('/c/1',))
+            thread.start()
+            thread.join()
+            return value
+
+        repath.register_converter('interleave', '\\d+', interleave)
+        try:
+            router.add('/a/:id')
+            router.add('/b/:id<interleave>')
+            router.add('/c/:id')
+            self.assertEqual(router.match('/b/1')[1], {'id': '1'})
+        finally:
+            del repath.CONVERTERS['interleave']
+
+        tried = metrics.snapshot()['tried']
+        self.assertEqual(tried['count'], 2)
+        self.assertEqual(tried['sum'], 1 + 3)
+
+    def test_should_keep_one_series_per_route_across_reloads(self):
+        metrics = repath.Metrics()
+        router = repath.Router(metrics=metrics)
+        router.extend([('/a/:id', 'x'), ('/b/:id', 'b')])
+        router.match('/a/1')
+        router.reload([('/a/:id', 'y')], background=False)
+        router.match('/a/2')
+
+        text = metrics.prometheus()
+        self.assertEqual(
+            text.count('repath_route_hits_total{id="0",route="/a/:id"}'), 1)
+        self.assertIn('repath_route_hits_total{id="0",route="/a/:id"} 2', text)
+        self.assertNotIn('/b/:id', text)
+
+    def test_should_render_prometheus_text_format(self):
+        self.router.match('/user/1')
+        text = self.metrics.prometheus()
+
+        self.assertIn('# TYPE repath_route_match_seconds histogram', text)
+        self.assertIn('repath_route_hits_total{id="1",route="/user/:id"} 1', text)
+        self.assertIn('repath_route_match_seconds_count{id="1",route="/user/:id"} 1', text)
+        self.assertIn('repath_routes_tried_bucket{le="+Inf"} 1', text)
+
+    def test_should_write_prometheus_file(self):
+        filename = os.path.join(tempfile.mkdtemp(), 'repath.prom')
+        self.metrics.write(filename)
+        with open(filename) as handle:
+            self.assertEqual(handle.read(), self.metrics.prometheus())
+
+    def test_should_not_instrument_without_metrics(self):
+        router = repath.Router()
+        route = router.add('/user/:id')
+        self.assertEqual(router.match.__name__, 'match')
+        self.assertNotIn('match', vars(route))
+
+
+class SlowHookTests(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        self.router = repath.Router(
+            slow=lambda *event: self.events.append(event), threshold=-1)
+        self.route = self.router.add('/user/:id(\\d+)')
+
+    def test_should_report_slow_matches(self):
+        self.router.match('/user/12')
+        path, pattern, value, elapsed = self.events[0]
+
+        self.assertEqual(path, '/user/:id(\\d+)')
+        self.assertEqual(pattern, self.route.pattern)
+        self.assertEqual(value, '/user/12')
+        self.assertGreaterEqual(elapsed, 0)
+
+    def test_should_report_slow_builds(self):
+        self.assertEqual(self.route.build({'id': 12}), '/user/12')
+        self.assertEqual(self.events[0][2], {'id': 12})
+
+    def test_should_not_report_matches_under_threshold(self):
+        router = repath.Router(slow=self.events.append, threshold=60)
+        router.add('/user/:id')
+        router.match('/user/1')
+        self.assertEqual(self.events, [])
+
+    def test_should_build_paths(self):
+        route = repath.Router().add('/user/:id')
+        self.assertEqual(route.build({'id': 'me'}), '/user/me')
+
+
+def regexp_parse(string):
+    """
+    The original `PATH_REGEXP` based implementation of `repath.parse`.
+
+    """
+    tokens = []
+    key = 0
+    index = 0
+    path = ''
+
+    for match in repath.PATH_REGEXP.finditer(string):
+        matched = match.group(0)
+        escaped = match.group(1)
+        offset = match.start(0)
+        path += string[index:offset]
+        index = offset + len(matched)
+
+        if escaped:
+            path += escaped[1]
+            continue
+
+        if path:
+            tokens.append(path)
+            path = ''
+
+        prefix, name, capture, group, suffix, asterisk = match.groups()[1:]
+        repeat = suffix in ('+', '*')
+        optional = suffix in ('?', '*')
+        delimiter = prefix or '/'
+        pattern = capture or group or ('.*' if asterisk else '[^%s]+?' % delimiter)
+
+        if not name:
+            name = key
+            key += 1
+
+        tokens.append({
+            'name': str(name),
+            'prefix': prefix or '',
+            'delimiter': delimiter,
+            'optional': optional,
+            'repeat': repeat,
+            'pattern': repath.escape_group(pattern),
+        })
+
+    if index < len(string):
+        path += string[index:]
+
+    if path:
+        tokens.append(path)
+
+    return tokens
+
+
+class ParseTests(unittest.TestCase):
+    def test_should_parse_corpus_like_regexp_implementation(self):
+        for case in TEST_CASES:
+            if isinstance(case[0], basestring):
+                self.assertEqual(repath.parse(case[0]), regexp_parse(case[0]))
+
+    def test_should_parse_random_paths_like_regexp_implementation(self):
+        rand = random.Random(0)
+        alphabet = '/.:()\\*+?ab_\n'
+        for _ in range(20000):
+            string = ''.join(rand.choice(alphabet)
+                             for _ in range(rand.randint(0, 16)))
+            self.assertEqual(repath.parse(string), regexp_parse(string),
+                             repr(string))
+
+    def test_should_resolve_ambiguous_escapes_like_regexp_implementation(self):
+        for string in ('/(\\)', '/:a(\\))', '/(\\)x', '/(a\\\\)b)', '/(\\\n)',
+                       u'/caf\u00e9/:id(\\d+)', '\\', '/:a(b)\\',
+                       '/:a(' + '\\.' * 2000 + ')', '/(' + '\\(' * 500 + ')'):
+            self.assertEqual(repath.parse(string), regexp_parse(string),
+                             repr(string))
+
+
+class ImportTests(unittest.TestCase):
+    def test_should_defer_urllib_and_regexp_compilation(self):
+        output = subprocess.check_output([sys.executable, '-c', (
+            'import sys, repath; '
+            'print("urllib" in sys.modules, repath.PATH_REGEXP._regexp)'
+        )], cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(output.strip(), '(False, None)')
+
+    def test_should_defer_table_and_threading_modules(self):
+        output = subprocess.check_output([sys.executable, '-c', (
+            'import sys, repath; '
+            'print(sorted(m for m in ("copy", "mmap", "struct", "threading", '
+            '"weakref", "zlib") if m in sys.modules))'
+        )], cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(output.strip(), '[]')
+
+    def test_should_compile_path_regexp_on_first_use(self):
+        match = repath.PATH_REGEXP.match('/:foo')
+        self.assertEqual(match.group(3), 'foo')
+
+
+class RouteTableTests(unittest.TestCase):
+    def test_should_not_change_published_tables(self):
+        router = repath.Router()
+        router.add('/foo')
+        table = router.table
+        router.add('/bar')
+
+        self.assertEqual(len(table), 1)
+        self.assertIsNone(table.match('/bar'))
+        self.assertIsNot(router.table, table)
+        self.assertEqual(router.match('/bar')[0].path, '/bar')
+
+    def test_should_extend_with_a_single_table(self):
+        router = repath.Router()
+        routes = router.extend([('/a', 1), ('/b/:id', 2, {'strict': True})])
+
+        self.assertEqual([r.index for r in routes], [0, 1])
+        self.assertEqual(router.match('/b/1')[0].value, 2)
+        self.assertTrue(router.routes[1].options['strict'])
+
+    def test_should_match_while_routes_are_added_concurrently(self):
+        router = repath.Router(adaptive=True, interval=7)
+        router.add('/base/:id')
+        errors = []
+
+        def read():
+            try:
+                for _ in range(2000):
+                    assert router.match('/base/1') is not None
+            except Exception as error:
+                errors.append(error)
+
+        def write():
+            for i in range(100):
+                router.add('/added/%d/:id' % i)
+
+        threads = [threading.Thread(target=read) for _ in range(4)]
+        threads.append(threading.Thread(target=write))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(router.routes), 101)
+        self.assertEqual(router.match('/added/99/x')[0].path, '/added/99/:id')
+
+
+class ReloadTests(unittest.TestCase):
+    def test_should_swap_tables_after_background_build(self):
+        router = repath.Router()
+        router.extend([('/old', 1), ('/old/:id', 2)])
+        old = router.table
+
+        reload = router.reload([('/new', 3)])
+        self.assertIs(reload.wait(5), reload)
+
+        self.assertIsNot(router.table, old)
+        self.assertIsNone(router.match('/old'))
+        self.assertEqual(router.match('/new')[0].value, 3)
+        self.assertEqual((reload.before, reload.after, reload.change), (2, 1, -1))
+        self.assertGreaterEqual(reload.duration, 0)
+
+    def test_should_keep_old_table_when_build_fails(self):
+        router = repath.Router()
+        router.add('/old')
+        reload = router.reload([('/:id(\\d+', None), (None,)], background=False)
+
+        self.assertIsNotNone(reload.error)
+        self.assertRaises(Exception, reload.wait)
+        self.assertIsNotNone(router.match('/old'))
+
+
+class IncrementalReloadTests(unittest.TestCase):
+    def setUp(self):
+        self.router = repath.Router(adaptive=True)
+        self.router.extend([
+            ('/a', 'a'), ('/b', 'b', {'strict': True}),
+            ('/users/:id', 'user'), ('/posts/:id', 'post'),
+        ])
+        self.table = self.router.table
+        self.table.blockers()
+
+    def test_should_reuse_unchanged_routes(self):
+        reload = self.router.reload([
+            ('/a', 'a'), ('/users/:id', 'user'), ('/tags/:id', 'tag'),
+            ('/posts/:id', 'new post'),
+        ], background=False)
+        old = dict((r.path, r) for r in self.table.routes)
+        new = dict((r.path, r) for r in self.router.routes)
+
+        self.assertEqual((reload.added, reload.removed, reload.reused), (1, 1, 3))
+        self.assertIs(new['/a'], old['/a'])
+        self.assertIs(new['/users/:id'].regexp, old['/users/:id'].regexp)
+        self.assertEqual(new['/users/:id'].index, 1)
+        self.assertIs(new['/posts/:id'].regexp, old['/posts/:id'].regexp)
+        self.assertEqual(new['/posts/:id'].value, 'new post')
+        self.assertEqual(new['/tags/:id'].index, 2)
+        self.assertEqual(self.router.match('/tags/1')[0].value, 'tag')
+        self.assertIsNone(self.router.match('/b'))
+
+    def test_should_share_unchanged_static_buckets(self):
+        self.router.reload([
+            ('/a', 'a'), ('/users/:id', 'user'),
+            ('/posts/:id', 'post'), ('/c', 'c', {'strict': True}),
+        ], background=False)
+
+        old = dict(self.table.static)
+        new = dict(self.router.table.static)
+        self.assertIs(new[(False, False)], old[(False, False)])
+        self.assertIsNot(new[(True, False)], old[(True, False)])
+
+    def test_should_reuse_method_partitions(self):
+        routes = [
+            ('/a', 'a', {'methods': ['GET']}), ('/b', 'b', {'methods': ['POST']}),
+            ('/users/:id', 'user', {'methods': ['GET']}),
+            ('/posts/:id', 'post', {'methods': ['POST']}), ('/:page', 'page'),
+        ]
+        self.router.reload(routes, background=False)
+        old = self.router.table
+        compared = []
+        disjoint = repath._disjoint
+
+        def recording(a, b):
+            compared.append((a.path, b.path))
+            return disjoint(a, b)
+
+        repath._disjoint = recording
+        try:
+            self.router.reload(
+                routes[:3] + [('/tags/:id', 'tag', {'methods': ['POST']})] +
+                routes[4:], background=False)
+        finally:
+            repath._disjoint = disjoint
+
+        new = self.router.table
+        self.assertIs(dict(new.methods['GET'].static)[(False, False)],
+                      dict(old.methods['GET'].static)[(False, False)])
+        self.assertTrue(compared)
+        self.assertTrue(all('/tags/:id' in pair for pair in compared))
+        self.assertEqual(self.router.match('/tags/1', 'POST')[0].value, 'tag')
+
+    def test_should_rebuild_like_a_fresh_table(self):
+        routes = [
+            ('/users/:id', 'user'), ('/users/:id(\\d+)', 'number'),
+            ('/posts/:id', 'post'), ('/a', 'a'),
+        ]
+        self.router.reload(routes, background=False)
+        fresh = repath.Router()
+        fresh.extend(routes)
+
+        def describe(routes):
+            return [(r.path, r.value, r.index) for r in routes]
+
+        self.assertEqual(describe(self.router.routes), describe(fresh.routes))
+        self.assertEqual(describe(self.router.table.dynamic),
+                         describe(fresh.table.dynamic))
+        self.assertEqual(self.router.table.blockers(), fresh.table.blockers())
+        self.assertEqual(self.router.match('/users/1')[0].value, 'number')
+
+    def test_should_rank_reordered_routes_by_new_position(self):
+        router = repath.Router()
+        router.extend([('/x/:a', 'A'), ('/x/:b', 'B')])
+        router.reload([('/x/:b', 'B'), ('/x/:a', 'A')], background=False)
+
+        self.assertEqual(router.match('/x/1')[0].value, 'B')
+
+    def test_should_change_option_as_new_route(self):
+        reload = self.router.reload([('/a', 'a', {'strict': True})],
+                                    background=False)
+        self.assertEqual((reload.added, reload.removed), (1, 4))
+
+
+class BulkCompileTests(unittest.TestCase):
+    def test_should_compile_like_route(self):
+        paths = [case[0] for case in TEST_CASES
+                 if isinstance(case[0], basestring) and case[0]]
+        specs = [(path, {'sensitive': i % 2 == 0})
+                 for i, path in enumerate(paths)]
+
+        for (path, options), compiled in zip(
+                specs, repath.bulk_compile(specs, 2)):
+            bulk = repath.Route(path, None, options, compiled=compiled)
+            local = repath.Route(path, None, options)
+
+            self.assertEqual(bulk.tokens, local.tokens)
+            self.assertEqual(bulk.pattern, local.pattern)
+            self.assertEqual(bulk.score, local.score)
+            self.assertEqual(bulk.regexp.flags, local.regexp.flags)
+            self.assertEqual(bulk.regexp.groupindex, local.regexp.groupindex)
+            for string in ('/', '/test', '/TEST/route', '/123', '/a.json'):
+                self.assertEqual(bulk.match(string), local.match(string))
+
+    def test_should_pass_sre_compile_arguments(self):
+        import sre_compile
+
+        class Recorder(object):
+            def __getattr__(self, name):
+                return getattr(original, name)
+
+            def compile(self, *arguments):
+                calls.append(arguments)
+
+        calls = []
+        patterns = [repath.Route(case[0], None, case[1]).pattern
+                    for case in TEST_CASES
+                    if isinstance(case[0], basestring) and case[0]]
+        original = sre_compile._sre
+        sre_compile._sre = Recorder()
+        try:
+            for pattern in patterns:
+                for flags in (0, re.I):
+                    del calls[:]
+                    sre_compile.compile(pattern, flags)
+                    self.assertEqual(
+                        repath._sre_arguments(pattern, flags), calls[0])
+        finally:
+            sre_compile._sre = original
+
+    def test_should_compile_without_sre_arguments(self):
+        original = repath.SRE_ARGUMENTS
+        repath.SRE_ARGUMENTS = False
+        try:
+            self.assertIsNone(repath._sre_arguments('/a', 0))
+            regexp = repath._sre_compile('/(a)', re.I, ('/(b)', 0, [], 0, {}, []))
+            self.assertEqual(regexp.pattern, '/(a)')
+            self.assertEqual(regexp.match('/A').group(1), 'A')
+        finally:
+            repath.SRE_ARGUMENTS = original
+
+    def test_should_reload_with_worker_processes(self):
+        router = repath.Router()
+        reload = router.reload([('/a/:id', 1), ('/b/:id(\\d+)', 2)],
+                               background=False, processes=2)
+
+        self.assertEqual(reload.added, 2)
+        self.assertEqual(router.match('/b/12'), (router.routes[1], {'id': '12'}))
+
+
+class LoadSourcesTests(unittest.TestCase):
+    def test_should_read_sources_concurrently(self):
+        barrier = threading.Event()
+
+        def first():
+            barrier.wait(5)
+            return [('/a/:id', 'a')]
+
+        def second():
+            barrier.set()
+            return [('/b/:id', 'b', {'strict': True}), ('/c', 'c')]
+
+        routes, timings = repath.load_sources([('first', first),
+                                               ('second', second)], 2)
+
+        self.assertTrue(barrier.is_set())
+        self.assertEqual([route[1] for route in routes], ['a', 'b', 'c'])
+        self.assertEqual(sorted(timings), ['first', 'second'])
+
+    def test_should_load_a_router(self):
+        router = repath.Router()
+        progress = router.load({
+            'users': lambda: [('/users/:id', 'users')],
+            'posts': lambda: [('/posts/:id', 'posts')],
+        }, background=False).wait()
+
+        self.assertEqual(progress.after, 2)
+        self.assertEqual(sorted(progress.sources), ['posts', 'users'])
+        self.assertEqual(router.match('/users/1')[0].value, 'users')
+        self.assertEqual(router.routes[0].value, 'posts')
+
+    def test_should_keep_the_table_when_a_source_fails(self):
+        router = repath.Router()
+        router.add('/kept', 'kept')
+
+        def broken():
+            raise IOError('missing manifest')
+
+        progress = router.load([('broken', broken)], background=False)
+
+        self.assertRaises(IOError, progress.wait)
+        self.assertEqual(router.match('/kept')[0].value, 'kept')
+
+
+class OpenAPITests(unittest.TestCase):
+    DOCUMENT = """{
+        "openapi": "3.0.0", "info": {"title": "API", "version": "1"},
+        "paths": {
+            "/users/{user-id}": {
+                "parameters": [{"name": "user-id", "in": "path",
+                                "schema": {"type": "integer"}}],
+                "get": {"operationId": "getUser"},
+                "put": {"parameters": [{"name": "user-id", "in": "path",
+                        "schema": {"type": "string", "format": "uuid"}}]}
+            },
+            "/files/{kind}.{ext}": {"get": {"parameters": [
+                {"name": "kind", "in": "path", "schema": {"enum": ["a.b", "c"]}},
+                {"name": "ext", "in": "path", "type": "string",
+                 "enum": ["json", "xml"]}
+            ]}}
+        },
+        "components": {"schemas": {"User": {"type": "object"}}}
+    }"""
+
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp(suffix='.json')
+        os.write(handle, self.DOCUMENT.encode('ascii'))
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_should_convert_path_templates(self):
+        self.assertEqual(repath.openapi_path('/a/{id}/b:c'), '/a/:id/b\\:c')
+        self.assertEqual(
+            repath.openapi_path('/a/{id}', [{'name': 'id', 'in': 'path',
+                                             'type': 'integer'}]),
+            '/a/:id(-?\\d+)')
+        self.assertEqual(
+            repath.openapi_path('/a/{x}', [{'name': 'x', 'in': 'path',
+                                            'schema': {'enum': ['a|b', 'c']}}]),
+            '/a/:x(a\\|b|c)')
+
+    def test_should_end_parameter_names_before_word_characters(self):
+        self.assertEqual(repath.openapi_path('/files/{name}_{ext}'),
+                         '/files/:name([^/]+?)_:ext')
+        self.assertEqual(repath.openapi_path('/f/{a}.{b}x'),
+                         '/f/:a.:b([^.]+?)x')
+        self.assertEqual(repath.openapi_path('/a/{id}+'), '/a/:id\\+')
+
+        route = repath.Route(repath.openapi_path('/v{version}abc'))
+        self.assertEqual(route.match('/v2abc'), {'version': '2'})
+        self.assertIsNone(route.match('/v2'))
+
+    def test_should_stream_routes(self):
+        routes = list(repath.openapi_routes(self.filename, '/v1'))
+
+        self.assertEqual([(value, options['methods']) for _, value, options
+                          in routes], [
+            ('getUser', ['GET']),
+            ('PUT /users/{user-id}', ['PUT']),
+            ('GET /files/{kind}.{ext}', ['GET']),
+        ])
+
+    def test_should_match_parameter_schemas(self):
+        router = repath.Router()
+        router.reload(repath.openapi_routes(self.filename), background=False)
+        uuid = '0d9c1f4e-1b2c-4d3e-8f9a-0123456789ab'
+
+        self.assertEqual(router.match('/users/-12', 'GET')[1],
+                         {'user_id': '-12'})
+        self.assertIsNone(router.match('/users/abc', 'GET'))
+        self.assertEqual(router.match('/users/' + uuid, 'PUT')[1],
+                         {'user_id': uuid})
+        self.assertIsNone(router.match('/users/12', 'PUT'))
+        self.assertEqual(router.match('/files/a.b.xml', 'GET')[1],
+                         {'kind': 'a.b', 'ext': 'xml'})
+        self.assertIsNone(router.match('/files/ab.json', 'GET'))
+
+    def test_should_read_json_values_across_buffers(self):
+        with open(self.filename, 'rb') as handle:
+            stream = repath._JSONStream(handle, size=3)
+            keys = []
+            for key in stream.items():
+                keys.append(key)
+                stream.value()
+
+        self.assertEqual(keys, ['openapi', 'info', 'paths', 'components'])
+
+    def test_should_skip_json_values_across_buffers(self):
+        document = ('{"a": {"b": ["]", "\\\\", "\\"}"], "c": {}}, "d": 1.5e3, '
+                    '"e": "x\\"y", "f": [[], [{}]], "g": true}')
+        for size in (1, 2, 3, 65536):
+            stream = repath._JSONStream(io.BytesIO(document), size=size)
+            keys = []
+            for key in stream.items():
+                keys.append(key)
+                stream.skip()
+            self.assertEqual(keys, ['a', 'd', 'e', 'f', 'g'], size)
+
+        stream = repath._JSONStream(io.BytesIO('{"a": [1, 2'))
+        self.assertEqual(next(stream.items()), 'a')
+        self.assertRaises(ValueError, stream.skip)
+
+
+class ConverterTests(unittest.TestCase):
+    def test_should_parse_converters(self):
+        tokens = repath.parse('/users/:id<int>/:other<unknown>')
+
+        self.assertEqual(tokens[1]['converter'], 'int')
+        self.assertEqual(tokens[1]['pattern'], '\\d+')
+        self.assertNotIn('converter', tokens[2])
+        self.assertEqual(tokens[3], '<unknown>')
+
+    def test_should_decode_matched_values(self):
+        route = repath.Route('/users/:id<int>/:score<float>?')
+
+        self.assertEqual(route.match('/users/12/1.5'), {'id': 12, 'score': 1.5})
+        self.assertEqual(route.match('/users/12'), {'id': 12, 'score': None})
+        self.assertIsNone(route.match('/users/abc'))
+
+    def test_should_encode_built_values(self):
+        uuid = __import__('uuid').UUID('0d9c1f4e-1b2c-4d3e-8f9a-0123456789ab')
+        route = repath.Route('/items/:id<uuid>/:n<int>+')
+
+        self.assertEqual(route.build({'id': uuid, 'n': [1, 2]}),
+                         '/items/%s/1/2' % uuid)
+        self.assertEqual(route.match(route.build({'id': uuid, 'n': [3]})),
+                         {'id': uuid, 'n': '3'})
+
+    def test_should_build_floats_the_pattern_matches(self):
+        route = repath.Route('/:f<float>')
+
+        for value in [1.5, 2, 1e16, 1.2345e22, 1.5e-05, 3e-10, 0.1]:
+            path = route.build({'f': value})
+            self.assertEqual(route.match(path), {'f': value}, path)
+        self.assertEqual(route.build({'f': 1e16}), '/10000000000000000')
+        self.assertEqual(route.build({'f': 1.5e-05}), '/0.000015')
+
+    def test_should_reject_values_the_converter_refuses(self):
+        def even(value):
+            if int(value) % 2:
+                raise ValueError(value)
+            return int(value)
+
+        repath.register_converter('even', '\\d+', even)
+        try:
+            route = repath.Route('/:n<even>')
+            self.assertEqual(route.match('/4'), {'n': 4})
+            self.assertIsNone(route.match('/3'))
+        finally:
+            del repath.CONVERTERS['even']
+
+
+class QuoteTests(unittest.TestCase):
+    def test_should_quote_like_urllib(self):
+        from urllib import quote
+
+        values = ['abc', 'a b/c', "-_.!~*'()", u'caf\u00e9', u'\u4e2d%',
+                  '\xc3\xa9', '', u'plain']
+        for value in values * 2:
+            data = value.encode('utf8') if isinstance(value, unicode) else value
+            self.assertEqual(repath._quote(value, repath.VALUE_QUOTING),
+                             quote(data, ''))
+            self.assertEqual(repath._quote(value, repath.SEGMENT_QUOTING),
+                             quote(data, "-_.!~*'()"))
+
+    def test_should_return_byte_strings(self):
+        self.assertIs(type(repath._quote(u'abc', repath.VALUE_QUOTING)), str)
+        self.assertIs(type(repath._quote(u'a b', repath.VALUE_QUOTING)), str)
+
+    def test_should_build_repeated_unicode_values(self):
+        build = repath.compile('/:tags+')
+
+        self.assertEqual(build({'tags': [u'caf\u00e9', 'a b']}),
+                         '/caf%C3%A9/a%20b')
+
+
+class DecodeTests(unittest.TestCase):
+    def test_should_not_decode_by_default(self):
+        route = repath.Route('/:name')
+
+        self.assertEqual(route.match('/a%20b'), {'name': 'a%20b'})
+
+    def test_should_decode_params(self):
+        route = repath.Route('/:name/:tags*', options={'decode': True})
+
+        self.assertEqual(route.match('/caf%C3%A9/a%2Fb/c'),
+                         {'name': u'caf\u00e9', 'tags': 'a/b/c'})
+        self.assertEqual(route.match('/plain'), {'name': 'plain', 'tags': None})
+        self.assertEqual(route.match('/%FF'), {'name': '\xff', 'tags': None})
+
+    def test_should_round_trip_built_paths(self):
+        route = repath.Route('/:id<int>/:name/:tags+', options={'decode': True})
+        params = {'id': 7, 'name': u"caf\u00e9 (au lait) 100%", 'tags': ['x y']}
+
+        self.assertEqual(route.match(route.build(params)),
+                         dict(params, tags='x y'))
+
+    def test_should_decode_in_routers(self):
+        router = repath.Router({'decode': True})
+        router.add('/users/:name', 'user')
+
+        self.assertEqual(router.match('/users/a%2Fb')[1], {'name': 'a/b'})
+
+
+class NormalizeTests(unittest.TestCase):
+    def test_should_normalize_paths(self):
+        for path, expected in [
+            ('/a/b', ('/a/b', ['a', 'b'])),
+            ('/a/b/', ('/a/b/', ['a', 'b'])),
+            ('', ('/', [])),
+            ('//a//b', ('/a/b', ['a', 'b'])),
+            ('/a/./b/.', ('/a/b/', ['a', 'b'])),
+            ('/a/../../b/c/..', ('/b/', ['b'])),
+            ('/a/.b/..c', ('/a/.b/..c', ['a', '.b', '..c'])),
+            ('/a/b?next=/c/../d#top', ('/a/b', ['a', 'b'])),
+        ]:
+            self.assertEqual(repath.normalize_path(path), expected, path)
+
+    def test_should_return_clean_paths_unchanged(self):
+        path = '/users/42'
+        self.assertIs(repath.normalize_path(path)[0], path)
+
+    def test_should_normalize_router_paths_like_normalize_path(self):
+        for path in ['/a/b', '/a/b/', '', '/', 'a/b', '.', '//a//b',
+                     '/a/./b/.', '/a/../../b/c/..', '/a/.b/..c', '/a/b#x?y',
+                     '/a/b?next=/c/../d#top', '/a?', '/a/..?x', '/.hidden']:
+            self.assertEqual(repath._normalized(path),
+                             repath.normalize_path(path)[0], path)
+
+    def test_should_normalize_before_matching(self):
+        router = repath.Router(normalize=True)
+        router.add('/users/:id', 'user', {'methods': ['GET']})
+
+        self.assertEqual(router.match('//users/./7/?page=2', 'GET')[1],
+                         {'id': '7'})
+        self.assertEqual(router.allowed('/x/../users/7'), set(['GET']))
+
+        router.normalize = False
+        self.assertIsNone(router.match('//users/7'))
+
+
+class CaseFoldingTests(unittest.TestCase):
+    def test_should_fold_case_agnostic_routes(self):
+        route = repath.Route('/Users/:id(\\d+)/:name/*')
+
+        self.assertTrue(route.folded)
+        self.assertEqual(route.regexp.flags & re.I, 0)
+        self.assertEqual(route.match('/USERS/12/Bob/A/b'),
+                         {'id': '12', 'name': 'Bob', '0': 'A/b'})
+        self.assertEqual(route.match(u'/users/12/Bob/x', u'/users/12/bob/x'),
+                         {'id': '12', 'name': 'Bob', '0': 'x'})
+        self.assertIsNone(route.match('/USERS/ab/Bob/x'))
+
+    def test_should_keep_ignoring_case_for_letter_patterns(self):
+        route = repath.Route('/:code([a-f]+)')
+
+        self.assertFalse(route.folded)
+        self.assertEqual(route.match('/ABC'), {'code': 'ABC'})
+
+    def test_should_keep_ignoring_case_for_letter_escapes(self):
+        for pattern in ('\\x41', '\\u0041', '\\101', '(?:a)\\1'):
+            self.assertFalse(repath._case_agnostic(
+                [{'pattern': pattern}]), pattern)
+        self.assertTrue(repath._case_agnostic([{'pattern': '\\d+\\.\\\\'}]))
+        self.assertEqual(repath.Route('/:c(\\x41)').match('/a'), {'c': 'a'})
+
+    def test_should_not_fold_sensitive_routes(self):
+        route = repath.Route('/Users/:id', options={'sensitive': True})
+
+        self.assertFalse(route.folded)
+        self.assertIsNone(route.match('/users/1'))
+        self.assertEqual(route.match('/Users/1'), {'id': '1'})
+
+    def test_should_only_fold_ascii_letters_like_re_i(self):
+        for path in (u'/CAF\u00c9/:id', u'/CAF\u00c9/:id([a-z]+)',
+                     u'/CAF\u00c9/x'):
+            router = repath.Router()
+            route = router.add(path)
+
+            self.assertIsNotNone(router.match(u'/caf\u00c9/x'), path)
+            self.assertIsNone(router.match(u'/caf\u00e9/x'), path)
+            self.assertIsNone(route.match(u'/caf\u00e9/x'), path)
+
+    def test_should_fold_bulk_compiled_routes(self):
+        compiled = repath.bulk_compile([('/Users/:id', {})], 1)[0]
+        route = repath.Route('/Users/:id', compiled=compiled)
+
+        self.assertTrue(route.folded)
+        self.assertEqual(route.match('/uSERS/Ab'), {'id': 'Ab'})
+
+
+class MountTests(unittest.TestCase):
+    ROUTES = [
+        ('/', {}), ('/api', {}), ('/api/v1/', {}), ('/API/v2', {'sensitive': True}),
+        ('/api/v1/users', {'strict': True}), ('/static/', {'strict': True}),
+        ('/api/:version', {}), ('/api/v1/users/:id', {'end': True}),
+        ('/apps', {}),
+    ]
+    PATHS = [
+        '', '/', '/api', '/api/', '/apix', '/api/v1', '/API/V1/x', '/api/v2/x',
+        '/API/v2/x', '/api/v1/users', '/api/v1/users/', '/api/v1/users/12',
+        '/static', '/static/', '/static/a.css', '/apps//x', 'api',
+    ]
+
+    def router(self, routes):
+        router = repath.Router({'end': False})
+        for path, options in routes:
+            router.add(path, path, options)
+        return router
+
+    def test_should_mount_literal_routes(self):
+        router = self.router(self.ROUTES)
+
+        self.assertEqual(sorted(route.path for route in router.table.mounted),
+                         ['/', '/API/v2', '/api', '/api/v1/', '/api/v1/users',
+                          '/apps'])
+        self.assertEqual(sorted(route.path for route in router.table.dynamic),
+                         ['/api/:version', '/api/v1/users/:id', '/static/'])
+
+    def test_should_match_like_a_scan(self):
+        for routes in (self.ROUTES, list(reversed(self.ROUTES))):
+            router = self.router(routes)
+            for path in self.PATHS:
+                candidates = [r for r in router.routes
+                              if r.match(path) is not None]
+                result = router.match(path)
+                if not candidates:
+                    self.assertIsNone(result, path)
+                    continue
+                expected = max(candidates, key=lambda r: r.rank)
+                self.assertIs(result[0], expected, path)
+                self.assertEqual(result[1], expected.match(path))
+
+    def test_should_find_the_longest_mount(self):
+        router = self.router([('/a', {}), ('/a/b/c', {}), ('/a/b', {})])
+
+        self.assertEqual(router.match('/a/b/c/d/e')[0].path, '/a/b/c')
+        self.assertEqual(router.match('/a/b/cd')[0].path, '/a/b')
+        self.assertEqual(router.match('/A/B')[0].path, '/a/b')
+
+
+class TailCaptureTests(unittest.TestCase):
+    ROUTES = ['/static/*', '/Files/:path*', '/files/:path+', '/s*', '/*',
+              '/file.:ext(.*)']
+    OPTIONS = [{}, {'strict': True}, {'sensitive': True}]
+    PATHS = ['', '/', '/static', '/static/', '/STATIC/a/B/', '/files',
+             '/files/', '/files/a/b', '/FILES/a/b/', '/files//a', '/files/a//',
+             '/file.tar.gz', '/s', '/sx/y', '/static/a\n', '/files/a\n']
+
+    def test_should_capture_tails_without_regexps(self):
+        self.assertIsNotNone(repath.Route('/static/*').tail)
+        self.assertIsNotNone(repath.Route('/files/:path*').tail)
+        self.assertIsNone(repath.Route('/files/:path*', options={'end': False}).tail)
+        self.assertIsNone(repath.Route('/files/:id/*').tail)
+        self.assertIsNone(repath.Route('/files/:n<int>+').tail)
+
+    def test_should_match_like_the_regexp(self):
+        for path in self.ROUTES:
+            for options in self.OPTIONS:
+                route = repath.Route(path, options=options)
+                flags = 0 if options.get('sensitive') else re.I
+                regexp = re.compile(route.pattern, flags)
+                for string in self.PATHS:
+                    match = regexp.match(string)
+                    expected = None if match is None else dict(
+                        zip(route.names, match.groups()))
+                    self.assertEqual(route.match(string), expected,
+                                     (path, options, string))
+
+
+class MappedRouteTableTests(unittest.TestCase):
+    def setUp(self):
+        self.router = repath.Router()
+        for i, case in enumerate(TEST_CASES):
+            if isinstance(case[0], basestring) and case[0]:
+                self.router.add(case[0], 'route %d' % i, case[1])
+        self.router.extend([
+            ('/user/me', 'me'), ('/user/:id', None),
+            (u'/caf\u00e9/:id', u'caf\u00e9'), ('/strict/', 's', {'strict': True}),
+            ('/decoded/:name', 'd', {'decode': True}),
+        ])
+        self.filename = os.path.join(tempfile.mkdtemp(), 'routes.table')
+        repath.dump_table(self.router.table, self.filename)
+        self.mapped = repath.MappedRouteTable(self.filename)
+
+    def tearDown(self):
+        self.mapped.close()
+
+    def test_should_match_like_route_table(self):
+        paths = [match[0] for case in TEST_CASES if len(case) > 3
+                 for match in case[3]]
+        paths.extend(['/user/me', '/USER/ME/', '/user/12', u'/caf\u00e9/1',
+                      '/strict/', '/strict', '/nope/nope/nope', '/decoded/a%20b',
+                      u'/CAF\u00c9/1', u'/CAF\u00e9/1'])
+
+        for path in paths:
+            expected = self.router.table.match(path)
+            result = self.mapped.match(path)
+            if expected is None:
+                self.assertIsNone(result, path)
+                continue
+            self.assertEqual(result[0].index, expected[0].index, path)
+            self.assertEqual(result[1], expected[1], path)
+
+    def test_should_decode_routes(self):
+        for id, route in enumerate(self.router.routes):
+            mapped = self.mapped.route(id)
+            self.assertEqual(mapped.path, route.path)
+            self.assertEqual(mapped.pattern, route.pattern)
+            self.assertEqual(mapped.value, route.value)
+            self.assertEqual(mapped.tokens, route.tokens)
+            self.assertEqual(mapped.rank, route.rank)
+
+    def test_should_build_paths(self):
+        route = self.mapped.match('/user/12')[0]
+        self.assertEqual(route.build({'id': 'bob'}), '/user/bob')
+
+    def test_should_reject_other_files(self):
+        with open(self.filename, 'wb') as handle:
+            handle.write('\0' * 64)
+        self.assertRaises(ValueError, repath.MappedRouteTable, self.filename)
+
+    def test_should_reject_unserializable_values(self):
+        router = repath.Router()
+        router.add('/foo', object())
+        self.assertRaises(TypeError, repath.dump_table, router.table,
+                          self.filename)
+
+    def test_should_reject_converters(self):
+        for path in ['/:n<int>', '/:n<int>+']:
+            router = repath.Router()
+            router.add(path)
+            self.assertRaises(TypeError, repath.dump_table, router.table,
+                              self.filename)
+
+
+class RegistryTests(unittest.TestCase):
+    def setUp(self):
+        self.registry = repath.Registry()
+        for tenant in ('a', 'b', 'c'):
+            self.registry.load(tenant, [
+                ('/users/:id', tenant), ('/posts/:id', 'posts'),
+                ('/%s/only' % tenant, 'own'),
+            ])
+
+    def test_should_share_compiled_routes_between_tenants(self):
+        a = self.registry.router('a').routes[0]
+        b = self.registry.router('b').routes[0]
+
+        self.assertIsNot(a, b)
+        self.assertIs(a.regexp, b.regexp)
+        self.assertIs(a.tokens, b.tokens)
+        self.assertEqual((a.value, b.value), ('a', 'b'))
+
+    def test_should_match_per_tenant(self):
+        self.assertEqual(self.registry.match('b', '/users/1')[0].value, 'b')
+        self.assertIsNotNone(self.registry.match('c', '/c/only'))
+        self.assertIsNone(self.registry.match('a', '/c/only'))
+        self.assertIsNone(self.registry.match('missing', '/users/1'))
+
+    def test_should_report_savings(self):
+        stats = self.registry.stats()
+
+        self.assertEqual(stats['tenants'], 3)
+        self.assertEqual(stats['routes'], 9)
+        self.assertEqual(stats['shared'], 5)
+        self.assertGreater(stats['saved_bytes'], 0)
+        self.assertEqual(stats['unshared_bytes'] - stats['bytes'],
+                         stats['saved_bytes'])
+
+    def test_should_drop_routes_no_tenant_uses(self):
+        self.registry.remove('c')
+        gc.collect()
+        self.assertEqual(len(self.registry.cache), 4)
+        self.assertNotIn('c', self.registry)
+
+
+class MethodRoutingTests(unittest.TestCase):
+    def setUp(self):
+        self.router = repath.Router()
+        self.router.extend([
+            ('/users/:id', 'show', {'methods': ['get', 'HEAD']}),
+            ('/users/:id', 'update', {'methods': ['PUT']}),
+            ('/users/me', 'me', {'methods': ['GET']}),
+            ('/health', 'health'),
+        ])
+
+    def test_should_match_only_routes_for_the_method(self):
+        self.assertEqual(self.router.match('/users/1', 'GET')[0].value, 'show')
+        self.assertEqual(self.router.match('/users/1', 'PUT')[0].value, 'update')
+        self.assertEqual(self.router.match('/users/me', 'GET')[0].value, 'me')
+        self.assertEqual(self.router.match('/users/me', 'HEAD')[0].value, 'show')
+        self.assertIsNone(self.router.match('/users/1', 'DELETE'))
+
+    def test_should_match_any_method_routes(self):
+        self.assertEqual(self.router.match('/health', 'PATCH')[0].value, 'health')
+        self.assertEqual(self.router.match('/health', 'GET')[0].value, 'health')
+
+    def test_should_match_every_route_without_a_method(self):
+        self.assertEqual(self.router.match('/users/me')[0].value, 'me')
+        self.assertEqual(self.router.match('/health')[0].value, 'health')
+
+    def test_should_report_allowed_methods(self):
+        self.assertEqual(self.router.allowed('/users/1', 'DELETE'),
+                         set(['GET', 'HEAD', 'PUT']))
+        self.assertEqual(self.router.allowed('/users/me', 'PUT'),
+                         set(['GET', 'HEAD']))
+        self.assertEqual(self.router.allowed('/health'), set())
+        self.assertEqual(self.router.allowed('/missing'), set())
+
+    def test_should_compare_methods_in_upper_case(self):
+        self.assertEqual(self.router.match('/users/1', 'get')[0].value, 'show')
+        self.assertEqual(self.router.match('/users/1', 'Put')[0].value, 'update')
+        self.assertEqual(self.router.allowed('/users/1', 'get'),
+                         set(['HEAD', 'PUT']))
+
+    def test_should_keep_partitions_when_reloading(self):
+        self.router.reload([
+            ('/users/:id', 'show', {'methods': ['GET']}),
+            ('/users/:id', 'delete', {'methods': ['DELETE']}),
+        ], background=False)
+
+        self.assertEqual(self.router.match('/users/1', 'DELETE')[0].value,
+                         'delete')
+        self.assertIsNone(self.router.match('/users/1', 'PUT'))
+
+    def test_should_not_dump_method_routes(self):
+        with tempfile.NamedTemporaryFile() as handle:
+            self.assertRaises(TypeError, repath.dump_table,
+                              self.router.table, handle.name)
+
+
+class MiddlewareTests(unittest.TestCase):
+    @staticmethod
+    def app(name):
+        def app(environ, start_response):
+            body = '%s %s' % (name, sorted(environ['repath.params'].items()))
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [body]
+        return app
+
+    def setUp(self):
+        from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_message(self, *args):
+                pass
+
+        router = repath.Router()
+        router.extend([
+            ('/users/:id', self.app('show'), {'methods': ['GET']}),
+            ('/users/:id', self.app('update'), {'methods': ['PUT']}),
+        ])
+        self.timings = []
+        application = repath.WSGIMiddleware(
+            router, timing=lambda *args: self.timings.append(args))
+
+        self.server = make_server('127.0.0.1', 0, application,
+                                  handler_class=QuietHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def request(self, path, method='GET'):
+        import httplib
+        connection = httplib.HTTPConnection(*self.server.server_address)
+        try:
+            connection.request(method, path)
+            response = connection.getresponse()
+            return response.status, response.getheader('allow'), response.read()
+        finally:
+            connection.close()
+
+    def test_should_dispatch_to_the_matched_route(self):
+        self.assertEqual(self.request('/users/42'),
+                         (200, None, "show [('id', '42')]"))
+        self.assertEqual(self.request('/users/42', 'PUT')[2],
+                         "update [('id', '42')]")
+
+    def test_should_respond_not_found(self):
+        self.assertEqual(self.request('/missing')[:2], (404, None))
+
+    def test_should_respond_method_not_allowed(self):
+        self.assertEqual(self.request('/users/42', 'DELETE')[:2],
+                         (405, 'GET, PUT'))
+
+    def test_should_report_timing(self):
+        self.request('/users/42')
+        self.request('/missing')
+
+        self.assertEqual([(path, result is not None)
+                          for path, result, elapsed in self.timings],
+                         [('/users/42', True), ('/missing', False)])
+        self.assertTrue(all(elapsed >= 0 for _, _, elapsed in self.timings))
+
+    def test_should_dispatch_asgi_scopes(self):
+        scopes = []
+
+        def app(name):
+            def app(scope, receive, send):
+                scopes.append(scope)
+                return name
+            return app
+
+        router = repath.Router()
+        router.add('/users/:id', app('show'))
+        application = repath.ASGIMiddleware(router, app('default'))
+
+        scope = {'type': 'http', 'path': '/users/1', 'method': 'GET'}
+        self.assertEqual(application(scope, None, None), 'show')
+        self.assertEqual(scopes[-1]['repath.params'], {'id': '1'})
+        self.assertIn('repath.time', scopes[-1])
+        self.assertEqual(scope, {'type': 'http', 'path': '/users/1',
+                                 'method': 'GET'})
+
+        scope = {'type': 'http', 'path': '/missing', 'method': 'GET'}
+        self.assertEqual(application(scope, None, None), 'default')
+        self.assertIsNone(scopes[-1]['repath.route'])
+        self.assertEqual(scopes[-1]['path'], '/missing')
+        self.assertNotIn('repath.route', scope)
+        self.assertEqual(application({'type': 'lifespan'}, None, None),
+                         'default')